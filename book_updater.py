@@ -1,15 +1,21 @@
 import asyncio
 import json
+import mimetypes
+import os
 import random
+import re
 import time
 import traceback
 import urllib.parse
-from typing import Union, Tuple
+import uuid
+from typing import Union, Tuple, Callable, Iterable, AsyncIterable, AsyncIterator
 
 from aiohttp import ClientResponse
 from aiohttp.client import ClientSession
 
 from abs_book_updater import AbstractBookUpdater, SyncBehavior
+from helpers.aimd_limiter import AimdLimiter
+from helpers import sequence_merge
 import aiohttp
 
 
@@ -30,6 +36,14 @@ class BookUpdater(AbstractBookUpdater):
         }
         self.max_retries: int = 3
         self.retry_delay: int = 3
+        # setup_host探测候选地址的超时
+        self.probe_connect_timeout: float = 3.0
+        self.probe_timeout: float = 30.0
+        self.keepalive_timeout: float = 60.0
+        # 上传封面的multipart字段名
+        self.cover_field: str = "file"
+        # 所有请求都经过它，按服务器的反馈调整并发
+        self.limiter: AimdLimiter = AimdLimiter()
 
     def get_routes(self, index_response: dict):
         self.books_segment = index_response["Book"]["segment"]
@@ -49,6 +63,13 @@ class BookUpdater(AbstractBookUpdater):
         print()
 
     async def setup_host(self, scheme: str, host: str) -> bool:
+        """
+        probe localhost and the given host concurrently, the first authorized response wins
+
+        :param scheme:
+        :param host:
+        :return:
+        """
         def assert_authorization(s: int) -> bool:
             if s == 401:
                 print("401 Unauthorized")
@@ -58,42 +79,58 @@ class BookUpdater(AbstractBookUpdater):
                 return False
             return True
 
-        async def connection_test():
-            return await self.fetch_data()
+        local_url = "http://127.0.0.1"
+        candidates = [local_url, f"{scheme}://{host}"]
+        print(f"try connecting to {', '.join(candidates)}")
+        probes = {asyncio.ensure_future(self.__probe(base_url)): base_url for base_url in candidates}
+        pending = set(probes)
         try:
-            self.base_url: str = "http://127.0.0.1"
-            print(f"try connecting to {self.base_url}")
-
-            status, response = await connection_test()
-            if status == 200:
-                self.get_routes(response)
-                print(f"setup {self.base_url} as host")
-                return True
-
-            if not assert_authorization(status):
-                self.base_url = ''
-                if status == 401:
-                    print("note for 401 on localhost: if you ensure your key is correct, "
-                          "please check if your reverse proxy forwards your ip (in this case 127.0.0.1) correctly")
-                return False
-
-            self.base_url = f"{scheme}://{host}"
-            print(f"try connecting to {self.base_url}")
-
-            status, response = await connection_test()
-            if status == 200:
-                self.get_routes(response)
-                print(f"setup {self.base_url} as host")
-                return True
-
-            assert_authorization(status)
-
-            print("fail to setup a host")
-            self.base_url = ''
-            return False
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # 同时返回时优先本地
+                for probe in sorted(done, key=lambda p: candidates.index(probes[p])):
+                    base_url = probes[probe]
+                    status, response = probe.result()
+                    if status == 200:
+                        self.base_url = base_url
+                        self.get_routes(response)
+                        print(f"setup {self.base_url} as host")
+                        return True
+
+                    if not assert_authorization(status) and status == 401 and base_url == local_url:
+                        print("note for 401 on localhost: if you ensure your key is correct, "
+                              "please check if your reverse proxy forwards your ip (in this case 127.0.0.1) correctly")
         except Exception as e:
             print(repr(e))
+            self.base_url = ''
             return False
+        finally:
+            # 输掉的探测直接取消
+            for probe in pending:
+                probe.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        print("fail to setup a host")
+        self.base_url = ''
+        return False
+
+    async def __probe(self, base_url: str) -> Tuple[int, Union[dict, list, str]]:
+        """
+        one request to the api index of a candidate host, without retry and with a short connect timeout
+
+        :param base_url:
+        :return: status code (9999 on failure) and response object
+        """
+        url = "/".join([base_url, self.namespace])
+        try:
+            response: ClientResponse
+            async with self.session.get(url, timeout=aiohttp.ClientTimeout(total=self.probe_timeout,
+                                                                           connect=self.probe_connect_timeout)) \
+                    as response:
+                return await self.json_result_from_response(response)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"cannot connect to {base_url}: {repr(e)}")
+            return 9999, {}
 
     def books_url(self, title: str = None, author: dict = None) -> str:
         url = "/".join([self.books_segment])
@@ -107,6 +144,12 @@ class BookUpdater(AbstractBookUpdater):
         else:
             return url
 
+    def books_page_url(self, page: int, per_page: int, modified_after: str = None) -> str:
+        params = {"page": page, "per_page": per_page}
+        if modified_after:
+            params["modified_after"] = modified_after
+        return self.books_segment + "?" + urllib.parse.urlencode(params)
+
     def book_url(self, book_id: int) -> str:
         """
         /books/{id}
@@ -188,19 +231,41 @@ class BookUpdater(AbstractBookUpdater):
 
     def create_session(self) -> None:
         if self.session is None:
-            self.session = aiohttp.ClientSession(headers=self.headers)
+            # 连接池与限流器的上限一致，空闲连接保持一段时间供下一本书复用
+            connector = aiohttp.TCPConnector(limit=self.limiter.maximum,
+                                             keepalive_timeout=self.keepalive_timeout,
+                                             ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(headers=self.headers, connector=connector)
+
+    async def warm_up(self, connections: int = None) -> None:
+        """
+        open pooled connections (tcp + tls) to the host in advance
+
+        :param connections: default the initial concurrency of the limiter
+        :return:
+        """
+        if not self.base_url:
+            return
+        connections = connections or int(self.limiter.limit)
+        await asyncio.gather(*[self.__probe(self.base_url) for _ in range(connections)])
 
     async def close_session(self) -> None:
         if self.session is not None:
             await self.session.close()
             self.session = None
 
-    async def fetch_data(self, sub_path: str = None, method: str = 'GET', data: str = None)\
-            -> Tuple[int, Union[dict, list, str]]:
+    async def fetch_data(self,
+                         sub_path: str = None,
+                         method: str = 'GET',
+                         data: Union[str, Callable[[], AsyncIterator[bytes]]] = None,
+                         max_retries: int = None,
+                         headers: dict = None) -> Tuple[int, Union[dict, list, str]]:
         """
         :param sub_path: request url
         :param method: http method in string
-        :param data: body serialized to string
+        :param data: body serialized to string, or a factory returning a fresh chunk stream for every attempt
+        :param max_retries: override self.max_retries (e.g. 1 for one-shot bodies)
+        :param headers: extra headers overriding the session ones (e.g. content-type)
         :return: status code (9999 on failure) and response object
         """
         # url = "/".join([self.base_url, self.namespace])
@@ -227,16 +292,24 @@ class BookUpdater(AbstractBookUpdater):
         url = "/".join([self.base_url, self.namespace])
         if sub_path:
             url += "/" + sub_path
+        # 限流器按请求种类比较延迟：books/12/volumes/3/chapters -> books/#/volumes/#/chapters
+        route = f"{method} {re.sub(r'[0-9]+', '#', (sub_path or '').split('?')[0])}"
 
-        for i in range(self.max_retries):
+        result = 9999, {}
+        for i in range(self.max_retries if max_retries is None else max_retries):
             if i != 0:
                 duration = random.uniform(1, self.retry_delay) * i
                 print(f"{duration}秒后进行第{i}次重试")
-                time.sleep(duration)
+                await asyncio.sleep(duration)
+
+            result = 9999, {}
+            await self.limiter.acquire()
+            start = time.monotonic()
             try:
+                body = data() if callable(data) else data
                 response: ClientResponse
-                async with self.session.request(method, url, data=data) as response:
-                    return await self.json_result_from_response(response)
+                async with self.session.request(method, url, data=body, headers=headers) as response:
+                    result = await self.json_result_from_response(response)
 
             except aiohttp.ClientResponseError as e:
                 print("返回错误：", url, e)
@@ -244,11 +317,21 @@ class BookUpdater(AbstractBookUpdater):
                 print("连接错误：", url)
             except aiohttp.ServerTimeoutError:
                 print("服务器超时：", url)
+            except asyncio.TimeoutError:
+                print("服务器超时：", url)
             except Exception as e:
                 print("捕获了一个未知异常：", url, e)
                 print(traceback.format_exc())
+            finally:
+                # 延迟、状态码反馈给限流器
+                await self.limiter.release(time.monotonic() - start, None if result[0] == 9999 else result[0],
+                                           route)
 
-        return 9999, {}
+            # 429/5xx：服务器过载，退避后重试
+            if result[0] != 9999 and result[0] != 429 and result[0] < 500:
+                return result
+
+        return result
 
     async def match_book(self, title: str, author: dict) -> Tuple[int, Union[dict, list, str]]:
         """
@@ -260,6 +343,18 @@ class BookUpdater(AbstractBookUpdater):
         """
         return await self.fetch_data(self.books_url(title, author))
 
+    async def list_books(self, page: int, per_page: int = 100, modified_after: str = None) \
+            -> Tuple[int, Union[dict, list, str]]:
+        """
+        one page of the books collection
+
+        :param page: from 1
+        :param per_page:
+        :param modified_after: optional, only books modified after this time
+        :return: status code and response object
+        """
+        return await self.fetch_data(self.books_page_url(page, per_page, modified_after))
+
     async def get_book(self, book_id: int) -> Tuple[int, Union[dict, list, str]]:
         """
         get one book by id
@@ -308,6 +403,85 @@ class BookUpdater(AbstractBookUpdater):
         """
         return await self.fetch_data(self.volume_chapter_url(book_id, volume_id), 'POST', json.dumps(data))
 
+    async def append_volume_chapter_stream(self,
+                                           book_id: int,
+                                           volume_id: int,
+                                           chapters: Union[Callable[[], Union[Iterable[dict], AsyncIterable[dict]]],
+                                                           Iterable[dict], AsyncIterable[dict]])\
+            -> Tuple[int, Union[dict, list, str]]:
+        """
+        append chapters to given volume of book, the json array body is streamed chapter by chapter,
+        so only one chapter is serialized in memory at a time
+
+        :param book_id:
+        :param volume_id:
+        :param chapters: (a)sync iterable of json like dicts, or a callable returning a new one.
+                         only a callable can be replayed, so a plain iterable is sent without retry
+        :return: status code and response object
+        """
+        if callable(chapters):
+            return await self.fetch_data(self.volume_chapter_url(book_id, volume_id), 'POST',
+                                         lambda: self.json_array_stream(chapters()))
+
+        return await self.fetch_data(self.volume_chapter_url(book_id, volume_id), 'POST',
+                                     lambda: self.json_array_stream(chapters), max_retries=1)
+
+    @staticmethod
+    async def json_array_stream(items: Union[Iterable, AsyncIterable]) -> AsyncIterator[bytes]:
+        """
+        serialize items to a json array, chunk by chunk
+
+        :param items: (a)sync iterable of json serializable objects
+        :return: async generator of encoded chunks
+        """
+        yield b"["
+        first = True
+        if isinstance(items, AsyncIterable):
+            async for item in items:
+                yield (b"" if first else b",") + json.dumps(item).encode('utf-8')
+                first = False
+        else:
+            for item in items:
+                yield (b"" if first else b",") + json.dumps(item).encode('utf-8')
+                first = False
+        yield b"]"
+
+    async def upload_cover(self, book_id: int, file_path: str, chunk_size: int = 64 * 1024) \
+            -> Tuple[int, Union[dict, list, str]]:
+        """
+        upload the cover image of book as multipart/form-data, the file is streamed chunk by chunk
+
+        :param book_id:
+        :param file_path: image file
+        :param chunk_size:
+        :return: status code and response object
+        """
+        boundary = uuid.uuid4().hex
+        file_name = os.path.basename(file_path).replace('"', "%22")
+        content_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+        head = (f"--{boundary}\r\n"
+                f"Content-Disposition: form-data; name=\"{self.cover_field}\"; filename=\"{file_name}\"\r\n"
+                f"Content-Type: {content_type}\r\n\r\n").encode('utf-8')
+        tail = f"\r\n--{boundary}--\r\n".encode('utf-8')
+
+        async def body() -> AsyncIterator[bytes]:
+            loop = asyncio.get_running_loop()
+            yield head
+            with open(file_path, 'rb') as file:
+                while True:
+                    chunk = await loop.run_in_executor(None, file.read, chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+            yield tail
+
+        # 给出长度，避免分块传输（php解析multipart需要）
+        headers = {
+            "Content-Type": f"multipart/form-data; boundary={boundary}",
+            "Content-Length": str(len(head) + os.path.getsize(file_path) + len(tail)),
+        }
+        return await self.fetch_data(self.cover_url(book_id), 'POST', body, headers=headers)
+
     async def append_volume(self, book_id: int, data: dict) -> Tuple[int, Union[dict, list, str]]:
         """
         append a volume to the book
@@ -325,10 +499,58 @@ class BookUpdater(AbstractBookUpdater):
         pass
 
     def is_adjacent(self, a, b, collection):
-        pass
+        """
+        :param a: title
+        :param b: title
+        :param collection: volumes or chapters (dicts with title)
+        :return: b comes right after a in collection
+        """
+        return sequence_merge.is_adjacent(a, b, [item["title"] for item in collection])
 
     def merge_book_info(self, old_info, new_info, rm_behavior: SyncBehavior = SyncBehavior.MergeRemovedWithInertia):
-        pass
+        """
+        operations that turn the remote book into the local one, volumes and chapters matched by title
+        (repeated titles by occurrence), aligned by the longest common subsequence, so only chapters
+        reordered, inserted or removed cost an operation.
+        chapters of volumes with the same title are merged, as in the import.
+        a chapter moved to another volume is an insert there, plus a delete with DiscardRemoved
+
+        :param old_info: remote book {"volumes": [{"id", "title", "chapters": [{"id", "title"}]}]}
+        :param new_info: local book, volumes and chapters with title (and srcIdx)
+        :param rm_behavior: what to do with remote volumes / chapters missing locally
+        :return: [{"kind": "volume" | "chapter", "volume": volume title, "op": "insert" | "move" | "delete",
+                   "key", "item", "after": key or None, "append"}], keys are (title, occurrence)
+        """
+        def chapters_by_volume(info) -> dict:
+            result = {}
+            for volume in info["volumes"]:
+                result.setdefault(volume["title"], []).extend(volume["chapters"])
+            return result
+
+        def unique_volumes(info) -> list:
+            seen = {}
+            for volume in info["volumes"]:
+                seen.setdefault(volume["title"], volume)
+            return list(seen.values())
+
+        def title(item):
+            return item["title"]
+
+        merged_volumes, volume_operations = sequence_merge.merge_sequences(
+            unique_volumes(old_info), unique_volumes(new_info), title, rm_behavior)
+        operations = [dict(operation, kind="volume", volume=operation["key"][0]) for operation in volume_operations]
+
+        old_chapters = chapters_by_volume(old_info)
+        new_chapters = chapters_by_volume(new_info)
+        for volume in merged_volumes:
+            volume_title = volume["key"][0]
+            if volume["new"] is None:
+                # 保留的远端卷，章节不变
+                continue
+            _, chapter_operations = sequence_merge.merge_sequences(
+                old_chapters.get(volume_title, []), new_chapters.get(volume_title, []), title, rm_behavior)
+            operations += [dict(operation, kind="chapter", volume=volume_title) for operation in chapter_operations]
+        return operations
 
 
 if __name__ == '__main__':
@@ -1,17 +1,83 @@
 import asyncio
+import hashlib
+import os
 import re
+from collections import deque, OrderedDict
 from abc import ABC, abstractmethod
-from typing import Tuple, Union
+from typing import Tuple, Union, AsyncIterator, List, Any, Dict
 
+from abs_book_updater import SyncBehavior
 from book_updater import BookUpdater
+from helpers.aimd_limiter import AimdLimiter
+from helpers.boilerplate_filter import BoilerplateFilter
+from helpers.catalog import CatalogSnapshot
+from helpers.cover_store import CoverHashStore, file_sha256
+from helpers.dead_letter import DeadLetterStore
+from helpers.import_journal import ImportJournal
+from helpers.import_plan import ImportPlan
 from helpers.logger import Logger, eprint
 
 
+async def gather_or_cancel(*aws) -> list:
+    """
+    asyncio.gather, except that when one awaitable raises, the others are cancelled and awaited
+    before the error propagates, so none of them keeps running after the caller has given up
+
+    :param aws: coroutines / futures
+    :return: results in order
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        # 出错或自身被取消时，剩下的任务取消并等待结束
+        pending = [task for task in tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+    errors = [task.exception() for task in tasks if not task.cancelled()]
+    for error in errors:
+        if error is not None:
+            raise error
+    return [task.result() for task in tasks]
+
+
 class AbsBookCrawler(ABC):
+    # 章节内容导致的拒绝，二分出具体章节
+    BISECT_STATUSES = (400, 413, 422)
+
     def __init__(self):
         self.genre_mapping: dict = {}
         self.api_genres: dict = {}
+        # target name -> genre name -> id
+        self.target_genres: Dict[str, dict] = {}
+        # 第一个目标，兼容只有一个目标的用法
         self.book_updater: Union[BookUpdater, None] = None
+        self.book_updaters: List[BookUpdater] = []
+        self.journal: Union[ImportJournal, None] = None
+        # 设置后，失败的批次会二分到具体章节，记录后继续上传
+        self.dead_letters: Union[DeadLetterStore, None] = None
+        # 同时上传章节的卷数上限，实际并发由book_updater.limiter按服务器负载调整
+        self.volume_concurrency: int = 16
+        # 每批章节渲染时预读的章数
+        self.read_ahead: int = 4
+        # 多个目标时，渲染好的章节按srcIdx缓存，供进度较慢的目标复用
+        self.render_cache: OrderedDict = OrderedDict()
+        self.render_cache_size: int = 2048
+        # target name -> 远端书目快照，有快照时按书名作者在本地查找书籍
+        self.catalogs: Dict[str, CatalogSnapshot] = {}
+        # 设置后，渲染章节时删除广告之类的行
+        self.boilerplate_filter: Union[BoilerplateFilter, None] = None
+        # 上传封面（默认关闭），已上传的封面按内容哈希跳过
+        self.upload_covers: bool = False
+        self.cover_hashes: CoverHashStore = CoverHashStore()
+        # 同目录的cover.*也作为封面，该目录下的每本书都会用它
+        self.folder_covers: bool = False
+        # 远端有、本地没有的卷和章节如何处理，见BookUpdater.merge_book_info
+        self.sync_behavior: SyncBehavior = SyncBehavior.MergeRemovedWithInertia
+        # 收到中断请求后，当前批次完成即停止
+        self.stop_requested: bool = False
 
     async def __aenter__(self) -> "AbsBookCrawler":
         return self
@@ -24,43 +90,99 @@ class AbsBookCrawler(ABC):
                             pass_key: str,
                             schema: str = 'https',
                             host: str = 'novelcabinet.lndo.site',
-                            base_path: str = 'wp-json/kbp/v1') -> "AbsBookCrawler":
+                            base_path: str = 'wp-json/kbp/v1',
+                            limiter: AimdLimiter = None) -> "AbsBookCrawler":
         """
-        与api服务器建立会话连接
+        与api服务器建立会话连接，会话保持到close_updater（或者async with crawler结束）
+        可以多次调用，每次添加一个目标，incremental_insert会同时上传到所有目标
         :param user_name:
         :param pass_key:
         :param schema:
         :param host:
         :param base_path:
+        :param limiter: optional, request limiter of this host
         :return:
         """
-        self.book_updater = BookUpdater(base_path, user_name, pass_key)
-        self.book_updater.create_session()
+        updater = BookUpdater(base_path, user_name, pass_key)
+        if limiter is not None:
+            updater.limiter = limiter
+        updater.create_session()
 
-        if not await self.book_updater.setup_host(schema, host):
-            await self.close_updater()
+        if not await updater.setup_host(schema, host):
+            await updater.close_session()
             raise ConnectionError(f"cannot setup api connection to: {schema}://{host}\nuser:{user_name} key:{pass_key}")
 
-        if await self.fetch_genres() is False:
+        # 预先建立连接，第一本书不用等握手
+        await updater.warm_up()
+
+        self.book_updaters.append(updater)
+        self.book_updater = self.book_updaters[0]
+
+        if await self.fetch_genres(updater) is False:
             print("获取类型失败")
 
         return self
 
     async def close_updater(self):
-        await self.book_updater.close_session()
+        for updater in self.book_updaters:
+            await updater.close_session()
 
-    async def fetch_genres(self) -> bool:
-        [status, genres] = await self.book_updater.get_all_book_genres()
+    async def fetch_genres(self, updater: BookUpdater = None) -> bool:
+        updater = updater or self.book_updater
+        [status, genres] = await updater.get_all_book_genres()
         if status == 200:
-            self.api_genres = {item["name"]: item["id"] for item in genres}
+            self.target_genres[self._target_name(updater)] = {item["name"]: item["id"] for item in genres}
+            if updater is self.book_updater:
+                self.api_genres = self.target_genres[self._target_name(updater)]
             return True
         return False
 
+    @staticmethod
+    def _target_name(updater: BookUpdater) -> str:
+        """
+        :param updater:
+        :return: base url + namespace, identifies a target in journal and dead letters
+        """
+        return f"{updater.base_url}/{updater.namespace}"
+
+    async def sync_catalog(self, directory: str = None) -> None:
+        """
+        sync the book catalog of every target into a local snapshot, see helpers.catalog
+
+        :param directory: optional, snapshots are persisted there, so later runs only fetch modified books
+        :return:
+        """
+        for updater in self.book_updaters:
+            name = self._target_name(updater)
+            if name not in self.catalogs:
+                file_path = os.path.join(directory, hashlib.sha1(name.encode('utf-8')).hexdigest() + ".json") \
+                    if directory else None
+                self.catalogs[name] = CatalogSnapshot(file_path)
+
+            catalog = self.catalogs[name]
+            if await catalog.sync(updater):
+                print(f"catalog of {name}: {len(catalog.entries)} books")
+            else:
+                # 不支持分页的服务器，仍然逐本搜索
+                print(f"cannot sync catalog of {name}, books will be searched one by one")
+                del self.catalogs[name]
+
+    def request_stop(self) -> None:
+        """
+        ask incremental_insert to stop after the in-flight batch, progress is kept in the journal
+
+        :return:
+        """
+        self.stop_requested = True
+
     async def incremental_insert(self, batch_size: int = 50, logger: "Logger" = None) -> bool:
         """
         incremental insert volumes and chapters
-        all volumes will be appended to the end of the book
-        all chapters will be appended to the end of the volume
+        all volumes will be appended to the end of the book, created one by one in file order
+        all chapters will be appended to the end of the volume, volumes are uploaded concurrently,
+        chapters of a volume in order. volume creation overlaps with uploads of existing volumes
+        if a journal is set and the book was interrupted before, resume from the journal without fetching the book
+        with several targets (see setup_updater), all of them are uploaded concurrently, chapters are read once
 
         :return:
         """
@@ -69,72 +191,218 @@ class AbsBookCrawler(ABC):
             logger.register_context("progress")
             logger.register_context("function")
 
-        if self.book_updater is None:
+        if not self.book_updaters:
             raise TypeError("book updater not initialized")
 
-        async with self.book_updater as updater:
-            # 尝试获取基本信息
-            basic_info = await self._get_book_basic_info()
-            status, books = await updater.match_book(basic_info["title"], basic_info["author"])
-
-            # success, message = self.check_response(status, books, "search book")
-            # if not success:
-            if status >= 400:
-                # print(message)
+        try:
+            # 每个目标独立进度、独立失败，章节只读取渲染一次
+            # 一个目标出错时其他目标照常完成，全部结束后才换书，不会读到下一本书
+            results = await asyncio.gather(*[self.__insert_to(updater, batch_size, logger)
+                                             for updater in self.book_updaters], return_exceptions=True)
+        finally:
+            self._drop_render_cache()
+
+        errors = []
+        for updater, result in zip(self.book_updaters, results):
+            if isinstance(result, BaseException):
+                errors.append(result)
+                message = f"{self._target_name(updater)}: {type(result).__name__}: {result}"
                 if logger:
-                    logger.write_err_log(books, "search book")
+                    logger.write_err_log(message, "target")
                 else:
-                    self.__basic_error_log(books, "search book")
-                return False
+                    self.__basic_error_log(message, "target")
+        if errors:
+            raise errors[0]
+        return all(results)
 
-            # 尝试创建书籍
-            if type(books) is list and len(books) != 0:
-                # 查询到的第一条
-                book: dict = books[0]
+    def _drop_render_cache(self) -> None:
+        """
+        drop rendered chapters of the current source, must be called when the source changes
 
-                logger and logger.add_log("steps", "search", f"found: id={book['id']}", "step")
-            else:
-                logger and logger.add_log("steps", "search", f"not found, will insert", "step")
-
-                status, result = await updater.add_book({
-                    "title": basic_info["title"],
-                    "author": basic_info["author"],
-                    "excerpt": self._string_para_strip(basic_info["excerpt"]),
-                    "genres": self.__genre_map(basic_info["genres"]),
-                    "tags": basic_info["tags"],
-                    "volumes": [],
-                })
-
-                # 创建失败 出问题
-                # [success, message] = self.check_response(status, result, "create")
-                # if not success:
-                if status >= 400:
-                    # print(message)
-                    if logger:
-                        logger.write_err_log(result, "book")
-                    else:
-                        self.__basic_error_log(result, "create book")
-                    return False
-                # 创建结果的“data”字段
-                # print(result)
-                book: dict = result['data']
+        :return:
+        """
+        # 没有目标再需要的预读
+        for future in self.render_cache.values():
+            future.cancel()
+        self.render_cache.clear()
 
-                logger and logger.add_log("steps", "book", f"inserted, id={book['id']}", "step")
+    async def __insert_to(self, updater: BookUpdater, batch_size: int, logger: "Logger" = None) -> bool:
+        """
+        incremental_insert to one target: plan, then execute
 
+        :param updater: updater of the target
+        :param batch_size:
+        :param logger:
+        :return:
+        """
+        plan = await self.plan_insert(updater, batch_size, logger)
+        if plan is None:
+            return False
+        return await self.execute_plan(plan, updater, logger)
 
-            # print(book)
-            # 获取目标的目录
-            contents_info = await self._get_contents_info()
+    async def plan_insert(self, updater: BookUpdater = None, batch_size: int = 50,
+                          logger: "Logger" = None) -> Union[ImportPlan, None]:
+        """
+        work out what incremental_insert does on a target without writing anything:
+        find the book (journal, catalog or search), diff the remote contents with the parsed ones,
+        group missing chapters into batches
+
+        :param updater: updater of the target, default the first one
+        :param batch_size: chapters per request
+        :param logger:
+        :return: the plan, None if the remote book cannot be read
+        """
+        updater = updater or self.book_updater
+        # 会话随爬虫（setup_updater ~ close_updater）存在，各本书复用连接池
+        updater.create_session()
+        journal_key = self._journal_key(updater)
+        resume_state = self.journal.resume_state(journal_key) if journal_key else None
+        plan = ImportPlan(self._target_name(updater), self._source_key(), self._source_info())
+
+        if resume_state:
+            # 续传时不再获取远端目录
+            book: dict = {"id": resume_state["book_id"], "volumes": []}
+            plan.resumed = True
+            logger and logger.add_log("steps", "journal", f"resume: id={book['id']}", "step")
+        else:
+            # 同一来源已经完整导入过时，不需要远端目录
+            done = bool(journal_key) and self.journal.is_done(journal_key)
+            success, book = await self.__search_book(updater, logger, need_contents=not done)
+            if not success:
+                return None
+            if book is None:
+                book = {"id": None, "volumes": []}
+                plan.book_info = await self.__new_book_info(updater)
+        plan.book_id = book["id"]
+        plan.cover = self._cover_path() if self.upload_covers else None
+        if book["volumes"] is None:
+            logger and logger.add_log("steps", "journal", f"unchanged since imported: id={book['id']}", "step")
+            return plan
+
+        # print(book)
+        # 获取目标的目录
+        contents_info = await self._get_contents_info()
+
+        if book["id"] is not None and not resume_state:
+            # 只能追加到卷末，顺序不同、中间插入、删除的只报告
+            for operation in updater.merge_book_info(book, contents_info, self.sync_behavior):
+                if operation["op"] == "insert" and operation["append"]:
+                    continue
+                plan.operations.append({"kind": operation["kind"], "volume": operation["volume"],
+                                        "op": operation["op"], "title": operation["key"][0],
+                                        "after": operation["after"] and operation["after"][0]})
+            if plan.operations:
+                logger and logger.add_log("steps", "merge",
+                                          f"{len(plan.operations)} reorders / inserts in the middle / deletes "
+                                          f"not applied, new chapters are appended", "step")
+
+        # 记录volume title -> id的映射
+        volume_id_map = self.__parse_volume_id_map(book)
+        if resume_state:
+            volume_id_map.update(resume_state["volumes"])
+        plan.existing_volumes = volume_id_map
+
+        # 记录chapter title -> id的映射
+        chapter_id_map = self.__parse_chapter_id_map(book)
+        # 日志中已确认的章节（按源位置）
+        journaled_chapters = resume_state["chapters"] if resume_state else set()
+
+        # 同名卷的章节合并到一起，保证同一个远端卷内的顺序
+        volume_chapters = {}
+        for volume in contents_info["volumes"]:
+            volume_chapters.setdefault(volume["title"], []).extend(volume["chapters"])
+
+        for volume_title, chapters in volume_chapters.items():
+            plan.volumes.append({"title": volume_title, "id": volume_id_map.get(volume_title)})
+            # 只记录要插入的章节，内容在发送时逐章读取、渲染
+            pending = []
+            for chapter in chapters:
+                if tuple(chapter["srcIdx"]) in journaled_chapters:
+                    continue
+                if volume_title in chapter_id_map and chapter["title"] in chapter_id_map[volume_title]:
+                    plan.skipped.append(list(chapter["srcIdx"]))
+                    continue
+                pending.append({"title": chapter["title"], "srcIdx": list(chapter["srcIdx"])})
+
+            for i in range(0, len(pending), batch_size):
+                batch = pending[i:i + batch_size]
+                plan.batches.append({"volume": volume_title,
+                                     "chapters": batch,
+                                     "bytes": sum(self._chapter_size(chapter["srcIdx"]) for chapter in batch)})
+        return plan
+
+    async def execute_plan(self, plan: ImportPlan, updater: BookUpdater = None, logger: "Logger" = None,
+                           plan_path: str = None) -> bool:
+        """
+        run a plan of plan_insert. the book is created if needed, missing volumes are created one by one in file
+        order, chapter batches of different volumes are uploaded concurrently, batches of a volume in order.
+        volume creation overlaps with uploads of existing volumes.
+        with a journal, the book, volumes and chapters it records are reused / skipped, so a plan can be run again.
+        chapters are read from the current source, which must be the one the plan was made from
+
+        :param plan:
+        :param updater: updater of the plan target, default the configured updater of plan.target
+        :param logger:
+        :param plan_path: optional plan file, the ids of created book and volumes are saved back into it
+        :return:
+        """
+        if logger:
+            logger.register_context("step")
+            logger.register_context("progress")
+            logger.register_context("function")
 
-            # 记录volume title -> id的映射
-            volume_id_map = self.__parse_volume_id_map(book)
+        updater = updater or self.__updater_of(plan.target)
+        if updater is None:
+            raise ValueError(f"no updater of target {plan.target}")
+        updater.create_session()
+        journal_key = self._journal_key(updater)
+        # 计划可能被重复执行（失败后保留的计划文件之类），以日志中的进度为准
+        resume_state = self.journal.resume_state(journal_key) if journal_key else None
+        journaled_chapters = resume_state["chapters"] if resume_state else set()
+
+        book_id = plan.book_id
+        if book_id is None and resume_state:
+            book_id = resume_state["book_id"]
+        if book_id is None:
+            book = await self.__add_book(updater, plan.book_info, logger)
+            if book is None:
+                return False
+            book_id = book["id"]
+        if plan.book_id != book_id:
+            plan.book_id = book_id
+            plan_path and plan.save(plan_path)
+
+        if journal_key and not plan.resumed:
+            self.journal.record_book(journal_key, book_id)
+            # 续传时不再获取远端目录，已有的卷、章节也要记下
+            for title, volume_id in plan.existing_volumes.items():
+                self.journal.record_volume(journal_key, title, volume_id)
+        if journal_key and plan.skipped:
+            self.journal.record_chapters(journal_key, plan.skipped)
+
+        # 插入volumes：缺少的卷在后台按文件顺序逐个创建，已有卷的章节同时开始上传
+        loop = asyncio.get_running_loop()
+        volume_futures = {}
+        missing_titles = []
+        for volume in plan.volumes:
+            volume_futures[volume["title"]] = loop.create_future()
+            if volume["id"] is None and resume_state:
+                volume["id"] = resume_state["volumes"].get(volume["title"])
+            if volume["id"] is not None:
+                volume_futures[volume["title"]].set_result(volume["id"])
+            else:
+                missing_titles.append(volume["title"])
 
-            # 插入volumes
+        aborted = asyncio.Event()
+
+        async def create_volumes() -> bool:
             volume_counter = 0
-            for volume in contents_info["volumes"]:
-                if volume["title"] not in volume_id_map:
+            try:
+                for title in missing_titles:
+                    if aborted.is_set():
+                        break
 
-                    [status, json_data] = await updater.append_volume(book['id'], {"title": volume["title"]})
+                    [status, json_data] = await updater.append_volume(book_id, {"title": title})
 
                     # [success, message] = self.check_response(status, json_data, "create volume")
                     # if not success:
@@ -144,60 +412,391 @@ class AbsBookCrawler(ABC):
                             logger.write_err_log(json_data, "volume")
                         else:
                             self.__basic_error_log(json_data, "create volume")
-                        return False
+                        aborted.set()
+                        break
 
+                    volume_id = json_data["data"]["id"]
                     volume_counter += 1
                     # 登记新插入的volume title -> id，后面会用到
-                    volume_id_map[volume['title']] = json_data["data"]["id"]
+                    volume_futures[title].set_result(volume_id)
+                    journal_key and self.journal.record_volume(journal_key, title, volume_id)
+                    for volume in plan.volumes:
+                        if volume["title"] == title:
+                            volume["id"] = volume_id
+                    plan_path and plan.save(plan_path)
+            except BaseException:
+                # 响应异常之类，等待中的章节不再上传
+                aborted.set()
+                raise
+            finally:
+                # 没有创建成功的卷，等待它的章节直接放弃
+                for future in volume_futures.values():
+                    if not future.done():
+                        future.set_result(None)
 
             logger and logger.add_log("summary", "insert", f"book & volumes", "progress")
             if volume_counter > 0:
                 logger and logger.add_log("steps", "volume", f"{volume_counter} inserted", "step")
+            return not aborted.is_set()
+
+        semaphore = asyncio.Semaphore(self.volume_concurrency)
 
-            # 记录chapter title -> id的映射
-            chapter_id_map = self.__parse_chapter_id_map(book)
-
-            # 插入chapters
-            for volume in contents_info["volumes"]:
-                chapters = volume["chapters"]
-
-                for i in range(0, len(chapters), batch_size):
-                    batch = chapters[i:i + batch_size]
-                    chapter_data = []
-
-                    for chapter in batch:
-                        if volume["title"] not in chapter_id_map \
-                                or chapter["title"] not in chapter_id_map[volume["title"]]:
-                            chapter_data.append({
-                                "title": chapter["title"],
-                                "content": self._string_to_html_p(await self._get_one_chapter(chapter["srcIdx"]))
-                            })
-
-                    if len(chapter_data) > 0:
-                        # print(volume)
-                        book_id = book["id"]
-                        volume_id = volume_id_map[volume["title"]]
-                        # print(f"{book_id} {volume_id} {chapter_data}")
-                        status, data = await updater.append_volume_chapter(book_id, volume_id, chapter_data)
-
-                        # success, message = self.check_response(status, data, "create chapters")
-                        # if not success:
-                        if status >= 400:
-                            # print(message)
-                            if logger:
-                                logger.write_err_log(data, "volume")
-                            else:
-                                self.__basic_error_log(data, "create chapters")
+        async def insert_chapters(volume_title: str, batches: list) -> bool:
+            volume_id = await volume_futures[volume_title]
+            if volume_id is None:
+                return False
+
+            async with semaphore:
+                for batch in batches:
+                    if aborted.is_set():
+                        return False
+                    if self.stop_requested:
+                        self.journal and self.journal.flush()
+                        logger and logger.write_err_log("stop requested, progress saved in journal", "chapter")
+                        return False
+
+                    chapter_data = batch["chapters"]
+                    # print(f"{book_id} {volume_id} {chapter_data}")
+                    status, data = await updater.append_volume_chapter_stream(
+                        book_id, volume_id, lambda pending=chapter_data: self._render_chapters(pending))
+
+                    # success, message = self.check_response(status, data, "create chapters")
+                    # if not success:
+                    if status >= 400:
+                        # print(message)
+                        if logger:
+                            logger.write_err_log(data, "volume")
+                        else:
+                            self.__basic_error_log(data, "create chapters")
+                        if not self.__can_bisect(status):
+                            aborted.set()
                             return False
 
+                        failed = await self.__bisect_chapters(updater, book_id, volume_id, chapter_data,
+                                                              status, data)
+                        if failed is None:
+                            aborted.set()
+                            return False
+                        for chapter, failed_status, failed_data in failed:
+                            self.__add_dead_letter(updater, book_id, volume_id, volume_title, chapter,
+                                                   failed_status, failed_data)
+                        logger and logger.add_log("steps", "chapter",
+                                                  f"{len(chapter_data) - len(failed)} inserted, "
+                                                  f"{len(failed)} dead-lettered", "step")
+                    else:
                         logger and logger.add_log("steps", "chapter", f"{len(chapter_data)} inserted", "step")
 
-            # print(f"book inserted: {book['id']}")
-            logger and logger.add_log("summary", "insert", f"chapters", "progress")
-            logger and logger.add_log("summary", "done", f"book id={book['id']}", "function")
-            logger and logger.write_logs()
+                    journal_key and self.journal.record_chapters(journal_key,
+                                                                 [chapter["srcIdx"] for chapter in chapter_data])
             return True
 
+        # 插入chapters：不同卷并发
+        volume_batches = {volume["title"]: [] for volume in plan.volumes}
+        for batch in plan.batches:
+            chapters = [chapter for chapter in batch["chapters"] if tuple(chapter["srcIdx"]) not in journaled_chapters]
+            if chapters:
+                volume_batches[batch["volume"]].append(dict(batch, chapters=chapters))
+
+        # 封面与章节同时上传，失败只记录；出现异常时其余任务先取消，不会在调用方换书后继续读取
+        results = await gather_or_cancel(self.__upload_cover(updater, book_id, plan.cover, logger),
+                                         create_volumes(),
+                                         *[insert_chapters(title, batches)
+                                           for title, batches in volume_batches.items()])
+        if not all(results[1:]):
+            return False
+
+        journal_key and self.journal.record_done(journal_key)
+        # print(f"book inserted: {book_id}")
+        logger and logger.add_log("summary", "insert", f"chapters", "progress")
+        logger and logger.add_log("summary", "done", f"book id={book_id} @ {plan.target}", "function")
+        logger and logger.write_logs()
+        return True
+
+    async def __upload_cover(self, updater: BookUpdater, book_id: int, cover_path: Union[str, None],
+                             logger: "Logger" = None) -> bool:
+        """
+        upload the cover unless the same content was uploaded to the book before
+
+        :param updater:
+        :param book_id:
+        :param cover_path: image file, None for no cover
+        :param logger:
+        :return: success or not
+        """
+        if not cover_path or not os.path.exists(cover_path):
+            return True
+        target = self._target_name(updater)
+        content_hash = await asyncio.get_running_loop().run_in_executor(None, file_sha256, cover_path)
+        if self.cover_hashes.get(target, book_id) == content_hash:
+            return True
+
+        status, data = await updater.upload_cover(book_id, cover_path)
+        if status >= 400:
+            if logger:
+                logger.write_err_log(data, "cover")
+            else:
+                self.__basic_error_log(data, "upload cover")
+            return False
+        self.cover_hashes.set(target, book_id, content_hash)
+        logger and logger.add_log("steps", "cover", "uploaded", "step")
+        return True
+
+    def __updater_of(self, target: str) -> Union[BookUpdater, None]:
+        for updater in self.book_updaters:
+            if self._target_name(updater) == target:
+                return updater
+        return None
+
+    async def __search_book(self, updater: BookUpdater, logger: "Logger" = None, need_contents: bool = True) \
+            -> Tuple[bool, Union[dict, None]]:
+        """
+        search the book by title and author, in the catalog snapshot first
+
+        :param updater:
+        :param logger:
+        :param need_contents: the remote volumes and chapters are needed, otherwise a catalog hit returns
+                              {"id", "volumes": None} without any request
+        :return: success or not, book json dict (None if not found)
+        """
+        # 尝试获取基本信息
+        basic_info = await self._get_book_basic_info()
+
+        catalog = self.catalogs.get(self._target_name(updater))
+        book_id = catalog.lookup(basic_info["title"], basic_info["author"]["name"]) if catalog else None
+        if book_id is not None:
+            if not need_contents:
+                logger and logger.add_log("steps", "catalog", f"found: id={book_id}", "step")
+                return True, {"id": book_id, "volumes": None}
+            # 需要远端的卷和章节时才按id获取
+            status, book = await updater.get_book(book_id)
+            if status == 200:
+                logger and logger.add_log("steps", "catalog", f"found: id={book['id']}", "step")
+                return True, book
+            # 快照过期（比如被删除），回退到搜索
+        elif catalog and catalog.is_fresh():
+            # 刚同步过的快照里没有，就是没有
+            logger and logger.add_log("steps", "catalog", f"not found, will insert", "step")
+            return True, None
+
+        status, books = await updater.match_book(basic_info["title"], basic_info["author"])
+
+        # success, message = self.check_response(status, books, "search book")
+        # if not success:
+        if status >= 400:
+            # print(message)
+            if logger:
+                logger.write_err_log(books, "search book")
+            else:
+                self.__basic_error_log(books, "search book")
+            return False, None
+
+        if type(books) is list and len(books) != 0:
+            # 查询到的第一条
+            book: dict = books[0]
+
+            logger and logger.add_log("steps", "search", f"found: id={book['id']}", "step")
+            catalog and catalog.add(book)
+            return True, book
+
+        logger and logger.add_log("steps", "search", f"not found, will insert", "step")
+        return True, None
+
+    async def __new_book_info(self, updater: BookUpdater) -> dict:
+        """
+        :param updater:
+        :return: add_book payload of the current book on a target
+        """
+        basic_info = await self._get_book_basic_info()
+        return {
+            "title": basic_info["title"],
+            "author": basic_info["author"],
+            "excerpt": self._string_para_strip(basic_info["excerpt"]),
+            "genres": self.__genre_map(basic_info["genres"], updater),
+            "tags": basic_info["tags"],
+            "volumes": [],
+        }
+
+    async def __add_book(self, updater: BookUpdater, book_info: dict, logger: "Logger" = None) -> Union[dict, None]:
+        """
+        :param updater:
+        :param book_info: add_book payload
+        :param logger:
+        :return: book json dict, None on failure
+        """
+        status, result = await updater.add_book(book_info)
+
+        # 创建失败 出问题
+        # [success, message] = self.check_response(status, result, "create")
+        # if not success:
+        if status >= 400:
+            # print(message)
+            if logger:
+                logger.write_err_log(result, "book")
+            else:
+                self.__basic_error_log(result, "create book")
+            return None
+        # 创建结果的“data”字段
+        # print(result)
+        book: dict = result['data']
+
+        logger and logger.add_log("steps", "book", f"inserted, id={book['id']}", "step")
+        catalog = self.catalogs.get(self._target_name(updater))
+        catalog and catalog.add(book)
+        return book
+
+    def __can_bisect(self, status: int) -> bool:
+        """
+        only content related failures are worth splitting (bad request, too large, unprocessable).
+        throttling (429), server errors (5xx), connection failure and authorization are not:
+        they were already retried with backoff by fetch_data, and splitting would only multiply the requests
+
+        :param status:
+        :return:
+        """
+        return self.dead_letters is not None and status in self.BISECT_STATUSES
+
+    async def __bisect_chapters(self, updater: BookUpdater, book_id: int, volume_id: int, chapters: list,
+                                status: int, data: Any) -> Union[List[Tuple[Any, int, Any]], None]:
+        """
+        upload a refused batch in halves, recursively, until the offending chapters are isolated.
+        halves are sent in order, so accepted chapters keep their relative order
+
+        :param updater:
+        :param book_id:
+        :param volume_id:
+        :param chapters: the refused batch
+        :param status: status of the refusing response
+        :param data: the refusing response
+        :return: [(chapter, status, response)] of single refused chapters, None if a failure cannot be bisected
+        """
+        if len(chapters) == 1:
+            return [(chapters[0], status, data)]
+
+        failed = []
+        middle = len(chapters) // 2
+        for half in (chapters[:middle], chapters[middle:]):
+            status, data = await updater.append_volume_chapter_stream(
+                book_id, volume_id, lambda pending=half: self._render_chapters(pending))
+            if status < 400:
+                continue
+            if not self.__can_bisect(status):
+                return None
+            sub_failed = await self.__bisect_chapters(updater, book_id, volume_id, half, status, data)
+            if sub_failed is None:
+                return None
+            failed += sub_failed
+        return failed
+
+    def __add_dead_letter(self, updater: BookUpdater, book_id: int, volume_id: int, volume_title: str,
+                          chapter: Any, status: int, data: Any) -> None:
+        self.dead_letters.add({
+            "target": self._target_name(updater),
+            "book_id": book_id,
+            "volume_id": volume_id,
+            "volume": volume_title,
+            "title": chapter["title"],
+            "srcIdx": list(chapter["srcIdx"]),
+            "status": status,
+            "response": data,
+            **self._source_info(),
+        })
+
+    def _source_info(self) -> dict:
+        """
+        information needed to read the chapters of current book again later (e.g. path, encoding)
+
+        :return:
+        """
+        return {"source": self._source_key()}
+
+    def _journal_key(self, updater: BookUpdater = None) -> Union[str, None]:
+        """
+        journal key of current book on a target, None when journal is disabled or source has no identity
+
+        :param updater: updater of the target, default the first one
+        :return:
+        """
+        source_key = self._source_key()
+        if self.journal is None or source_key is None:
+            return None
+        return f"{self._target_name(updater or self.book_updater)}|{source_key}"
+
+    def _chapter_size(self, src_idx: Any) -> int:
+        """
+        size of a chapter in the source, used to estimate plans
+
+        :param src_idx:
+        :return: 0 if unknown
+        """
+        return 0
+
+    def _cover_path(self) -> Union[str, None]:
+        """
+        cover image of the current book source
+
+        :return: None if there is none
+        """
+        return None
+
+    def _source_key(self) -> Union[str, None]:
+        """
+        identity of the current book source (e.g. path, size and mtime), used by the journal
+
+        :return: None if the source cannot be identified
+        """
+        return None
+
+    async def _render_chapters(self, chapters: list) -> AsyncIterator[dict]:
+        """
+        read and render chapters one at a time
+
+        :param chapters: chapters in the form of _get_contents_info
+        :return: async generator of json like dicts ready to post
+        """
+        # 预读后面几章，读取与上传重叠
+        reads = deque()
+        try:
+            for chapter in chapters:
+                reads.append((chapter, self.__read_rendered(chapter)))
+                if len(reads) > self.read_ahead:
+                    _chapter, read = reads.popleft()
+                    yield {"title": _chapter["title"], "content": await read}
+            while reads:
+                _chapter, read = reads.popleft()
+                yield {"title": _chapter["title"], "content": await read}
+        finally:
+            # 上传中断时取消剩下的预读，缓存的可能还有别的目标要用
+            if len(self.book_updaters) <= 1:
+                for _, read in reads:
+                    read.cancel()
+
+    def __read_rendered(self, chapter: Any) -> asyncio.Future:
+        """
+        read and render a chapter in background, cached by srcIdx when there are several targets
+
+        :param chapter:
+        :return: future of the rendered content
+        """
+        if len(self.book_updaters) <= 1:
+            return asyncio.ensure_future(self.__render_one(chapter["srcIdx"]))
+
+        key = tuple(chapter["srcIdx"])
+        future = self.render_cache.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.__render_one(chapter["srcIdx"]))
+            self.render_cache[key] = future
+            if len(self.render_cache) > self.render_cache_size:
+                self.render_cache.popitem(last=False)
+        else:
+            self.render_cache.move_to_end(key)
+        return future
+
+    async def __render_one(self, src_idx: Any) -> str:
+        text = await self._get_one_chapter(src_idx)
+        if self.boilerplate_filter is not None:
+            text = self.boilerplate_filter.strip(text)
+        return self._string_to_html_p(text)
+
     @staticmethod
     def check_response(status: int, data: Union[dict, list, str], step_name: str = "") -> Tuple[bool, str]:
         """
@@ -218,7 +817,7 @@ class AbsBookCrawler(ABC):
             return True, ""
 
     @staticmethod
-    def __basic_error_log(self, data: Union[dict, list, str], step_name: str = "") -> None:
+    def __basic_error_log(data: Union[dict, list, str], step_name: str = "") -> None:
         err_str = "[error]"
         if step_name != "":
             err_str += f" [{step_name}]"
@@ -275,15 +874,18 @@ class AbsBookCrawler(ABC):
     def add_genres_mapping_rule(self, outer, inner):
         self.genre_mapping[outer] = inner
 
-    def __genre_map(self, outer_genres: str):
+    def __genre_map(self, outer_genres: str, updater: BookUpdater = None):
         """
         将一个字符串转换：从“外部类别”=>“api类别”=>“id”
         :param outer_genres:
+        :param updater: 目标，不同目标的类别id不同
         :return:
         """
+        api_genres = self.target_genres.get(self._target_name(updater), self.api_genres) if updater else self.api_genres
+
         def mp(genre):
-            if genre in self.genre_mapping and self.genre_mapping[genre] in self.api_genres:
-                return self.api_genres[self.genre_mapping[genre]]
+            if genre in self.genre_mapping and self.genre_mapping[genre] in api_genres:
+                return api_genres[self.genre_mapping[genre]]
             return ""
 
         return list(filter(lambda x: x != "", map(mp, outer_genres)))
@@ -4,19 +4,68 @@ import io
 import os
 import re
 import hashlib
+import heapq
 import time
-from typing import Any, Tuple
+import zipfile
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Tuple, Iterator, Union, List
 
 from crawlers.book_crawler import AbsBookCrawler
+from helpers.book_toc import BookToc
+from helpers.compressed_file import is_compressed_path
+from helpers.cover_store import find_cover
+from helpers.dead_letter import DeadLetterStore
+from helpers.fingerprint import book_sketch, content_hash
+from helpers.heading_classifier import HeadingClassifier
+from helpers.import_plan import ImportPlan
 from helpers.logger import Logger
+from helpers.parse_cache import ParseCache, PARSE_VERSION, sample_hash
 from helpers.txt_reader import TxtBookReader
+from helpers.zip_source import ZIP_MEMBER_SEPARATOR, is_zip_member_path, split_member_path, open_zip_member, \
+    zip_member_key, zip_member_exists, zip_member_info
 
 
 class LocalBookCrawler(AbsBookCrawler):
-    def __init__(self):
+    def __init__(self, heading_rules: str = None, parse_workers: int = 1):
         super().__init__()
         self.txt_reader: TxtBookReader = TxtBookReader()
         self.txt_book_data: dict = {}
+        self.heading_rules: Union[str, None] = heading_rules
+        self.heading_classifier: HeadingClassifier = HeadingClassifier(heading_rules)
+        # 大于这个尺寸的文件才分片并行解析
+        self.parse_workers: int = parse_workers
+        self.parallel_parse_threshold: int = 64 * 1024 * 1024
+        # 整个运行共用一个进程池（分叉出的crawler也共用），第一次提交时才启动进程
+        self.parse_executor: Union[ProcessPoolExecutor, None] = \
+            ProcessPoolExecutor(max_workers=parse_workers) if parse_workers > 1 else None
+        # 设置后，解析结果按来源缓存，未变化的文件再次打开时不再解析
+        self.parse_cache: Union[ParseCache, None] = None
+        # 打开的是压缩包成员时，它的ZipInfo（来源标识用，不再查找压缩包目录）
+        self.zip_info: Union[zipfile.ZipInfo, None] = None
+
+    def fork(self) -> "LocalBookCrawler":
+        """
+        a crawler with its own source reader, sharing api sessions, journal, dead letters, caches and settings
+        with this one, so several books can be imported at the same time. do not close its updaters
+
+        :return:
+        """
+        crawler = LocalBookCrawler.__new__(LocalBookCrawler)
+        crawler.__dict__.update(self.__dict__)
+        crawler.txt_reader = TxtBookReader()
+        crawler.txt_reader.read_executor = self.txt_reader.read_executor
+        crawler.txt_book_data = {}
+        crawler.zip_info = None
+        crawler.render_cache = OrderedDict()
+        return crawler
+
+    async def __aexit__(self, exc_type: Exception, exc_val, err_traceback) -> None:
+        await super().__aexit__(exc_type, exc_val, err_traceback)
+        if self.parse_executor is not None:
+            self.parse_executor.shutdown()
+            self.parse_executor = None
 
     def __enter__(self) -> "LocalBookCrawler":
         return self
@@ -25,15 +74,105 @@ class LocalBookCrawler(AbsBookCrawler):
         self.close()
 
     def open(self, file_path: str) -> "TxtBookReader":
+        """
+        :param file_path: a txt file, or a txt member of a zip archive (archive.zip::member.txt, see helpers.zip_source)
+        :return:
+        """
+        if is_zip_member_path(file_path):
+            if self.txt_reader.file is None:
+                self.zip_info = zip_member_info(file_path)
+                return self.txt_reader.open(file_path, open_zip_member(file_path, info=self.zip_info))
+            return self.txt_reader
         return self.txt_reader.open(file_path)
 
     def close(self) -> None:
+        self._drop_render_cache()
         self.txt_reader.close()
+        self.zip_info = None
 
     def load_contents(self, title: str = None, author: str = None) -> Any:
+        cache_key = None
+        if self.parse_cache is not None:
+            cache_key = self.__parse_cache_key(title, author)
+            cached = self.parse_cache.load(self.__source_path(self.txt_reader.file_path), cache_key)
+            if cached is not None:
+                self.txt_reader.encoding = cached.pop("encoding")
+                self.txt_book_data = cached
+                return
+
+        self.__parse_contents(title, author)
+        if cache_key is not None:
+            self.parse_cache.store(self.__source_path(self.txt_reader.file_path), cache_key, self.txt_reader.encoding,
+                                  self.txt_book_data)
+
+    def __parse_cache_key(self, title: Union[str, None], author: Union[str, None]) -> dict:
+        """
+        everything a parse result depends on
 
+        :param title:
+        :param author:
+        :return:
+        """
+        file_path = self.txt_reader.file_path
+        return {
+            "version": PARSE_VERSION,
+            "source": self._source_key(),
+            # 压缩包成员的source已包含crc
+            "sample": None if is_zip_member_path(file_path) else sample_hash(file_path),
+            "rules": zlib.crc32(f"{self.heading_classifier.max_length}|{self.heading_classifier.pattern.pattern}"
+                                .encode('utf-8')),
+            "title": title,
+            "author": author,
+        }
+
+    def __parse_contents(self, title: str = None, author: str = None) -> None:
+        # 子进程按偏移直接读取原文件，压缩包内的文件、压缩文件只在本进程解析
+        file_path = self.txt_reader.file_path
+        if self.parse_executor is not None and not is_zip_member_path(file_path) and not is_compressed_path(file_path) \
+                and os.path.getsize(file_path) >= self.parallel_parse_threshold:
+            # 分片在子进程中解码、分类
+            self.txt_book_data = self.txt_reader.scan_file(
+                lambda reader: self._load_contents_scanner_handler(reader, title, author,
+                                                                   self.parse_workers, self.heading_rules,
+                                                                   self.parse_executor))
+            return
+
+        # 一遍读取：分块时顺带统计字数，只对候选标题行套用标题规则
         self.txt_book_data = self.txt_reader.scan_file(
-            lambda reader: self._load_contents_scanner_handler(reader, title, author))
+            lambda reader: self._load_contents_scanner_handler(reader, title, author),
+            self.heading_classifier.classify)
+
+    def fingerprint(self, k: int = 128, sample_chapters: int = 32, max_chars: int = 64 * 1024,
+                    key_bytes: int = 256) -> List[int]:
+        """
+        MinHash sketch over chapter text of the loaded book, see helpers.fingerprint. blocking file io
+        chapters are sampled by content: the ones whose opening text hashes smallest, so adding, removing or
+        splitting a chapter changes at most a few samples. only a bounded head of every chapter is read,
+        titles, excerpt and head/tail banners are not included
+
+        :param k: sketch size
+        :param sample_chapters: at most this many chapters are sampled
+        :param max_chars: at most this many characters are hashed
+        :param key_bytes: bytes read from every chapter to choose the samples
+        :return: sketch
+        """
+        toc: BookToc = self.txt_book_data["volumes"]
+        chapter_count = toc.chapter_count()
+        if chapter_count == 0:
+            return []
+
+        def chapter_head(i: int, size: int) -> str:
+            start, end = toc.chapter_starts[i], toc.chapter_ends[i]
+            data = self.txt_reader.read_at(start, min(end - start, size))
+            # 截断处可能是半个字符；章节范围从标题行之后开始，只去掉缩进
+            return data.decode(self.txt_reader.encoding, errors="ignore").lstrip()
+
+        samples = heapq.nsmallest(sample_chapters,
+                                  ((content_hash(chapter_head(i, key_bytes)), i) for i in range(chapter_count)))
+        per_chapter = max_chars // len(samples)
+        # 按字节读取，一个字符最多4字节
+        texts = (chapter_head(i, per_chapter * 4)[:per_chapter] for i in sorted(i for _, i in samples))
+        return book_sketch(texts, k)
 
     async def debug_print(self, brief: bool = True):
         # print(self.txt_book_data['excerpt'])
@@ -62,117 +201,193 @@ class LocalBookCrawler(AbsBookCrawler):
         # print(self._get_one_chapter(self._get_contents_info()['volumes'][0]['chapters'][0]['srcIdx']))
 
     @staticmethod
-    def _load_contents_scanner_handler(reader: TxtBookReader, title_input, author_input) -> dict:
-        def find_first_volume_or_chapter_char(input_str):
-            for char in input_str:
-                if char == '卷' or char == '章':
-                    return char
-            return None
+    def _must_be_chapter(reader: TxtBookReader, s_pos: int, e_pos: int) -> bool:
+        # 1000 characters
+        return reader.char_count(s_pos, e_pos) > 1000
+
+    @staticmethod
+    def _maybe_chapter(reader: TxtBookReader, s_pos: int, e_pos: int) -> bool:
+        # 300 characters
+        return reader.char_count(s_pos, e_pos) > 300
+
+    @staticmethod
+    def _read_content_block(reader: TxtBookReader, _last_empty: int) -> Tuple[str, str, int, int]:
+        """
+        如何区分卷、章、错误排版？
+        1. 一般情况下，两行空格是卷、章的标志，但是可以看到存在错误排版：
+            i. 只空了一行，但是是卷/章
+            ii. 空了两行，但其实并不是卷/章
+
+        首先是不是章/卷，有一个比较准确的判断：
+            i. 出现了卷/章这种字眼（见heading_rules.json）
+            ii. 行字符小于50
+        这样十有八九是卷，如果这都不是，我自认倒霉
+
+        对于是不是章，可以这么判断：
+        如果内容长（大于3000）字节，那么十有八九是章，如果这都不是，我自认倒霉
+
+        2. 需要区分的内容有四类：
+            i. 简介
+            ii. 卷
+            iii. 章
+            iv. 其它真的不能归于任何一类的自然段
+        我们希望iv越少越好
+        为了减少孤儿自然段，考虑将其进行计数，在1.ii的基础上，如果长度短于3000字节，把它归为上一部分中
 
-        def byte_to_char(byte_len):
-            if reader.encoding == 'utf-8':
-                return byte_len / 3
-            if reader.encoding == 'gb18030' or reader.encoding == 'gb2312':
-                return byte_len / 2
-            return len
-
-        def must_be_chapter(s_pos, e_pos):
-            # 1000 characters
-            return byte_to_char(e_pos - s_pos) > 1000
-
-        def maybe_chapter(s_pos, e_pos):
-            # 300 characters
-            return byte_to_char(e_pos - s_pos) > 300
-
-        def read_content_block(_last_empty: int) -> Tuple[str, str, int, int]:
-            """
-            如何区分卷、章、错误排版？
-            1. 一般情况下，两行空格是卷、章的标志，但是可以看到存在错误排版：
-                i. 只空了一行，但是是卷/章
-                ii. 空了两行，但其实并不是卷/章
-
-            首先是不是章/卷，有一个比较准确的判断：
-                i. 出现了卷/章这种字眼
-                ii. 行字符小于50
-            这样十有八九是卷，如果这都不是，我自认倒霉
-
-            对于是不是章，可以这么判断：
-            如果内容长（大于3000）字节，那么十有八九是章，如果这都不是，我自认倒霉
-
-            2. 需要区分的内容有四类：
-                i. 简介
-                ii. 卷
-                iii. 章
-                iv. 其它真的不能归于任何一类的自然段
-            我们希望iv越少越好
-            为了减少孤儿自然段，考虑将其进行计数，在1.ii的基础上，如果长度短于3000字节，把它归为上一部分中
-
-            """
-            _title = ""
-            _is_volume = False
-            _is_chapter = False
-            # 有没有标题先？
-            line = reader.peek_line().lower()
-            # print("line: " + line)
-            if len(line) <= 50:
-                # 也许是标题了
-                _title = reader.readline()
-                _next_line = reader.peek_line()
-
-                # 标题确定，剩下的就是内容了
-                s_pos = reader.tell()
-                reader.read_continuous_content_lines()
-                e_pos = reader.tell()
-
-                # 那下面是可以实锤的情况
-                # 1. 小说里字很多的是什么？章节！
-                if must_be_chapter(s_pos, e_pos):
+        """
+        _title = ""
+        _is_volume = False
+        _is_chapter = False
+        # 有没有标题先？
+        line = reader.peek_line().lower()
+        # print("line: " + line)
+        if len(line) <= 50:
+            # 也许是标题了
+            _title = reader.readline()
+            _next_line = reader.peek_line()
+
+            # 标题确定，剩下的就是内容了
+            s_pos = reader.tell()
+            reader.read_continuous_content_lines()
+            e_pos = reader.tell()
+
+            # 那下面是可以实锤的情况
+            # 1. 小说里字很多的是什么？章节！
+            if LocalBookCrawler._must_be_chapter(reader, s_pos, e_pos):
+                _is_chapter = True
+            else:
+                # 2. 好吧，命中了标题规则，认为必出一狼
+                kind = reader.classify_line(_title)
+                if kind == "volume":
+                    _is_volume = True
+                elif kind == "chapter":
                     _is_chapter = True
+                # 3. 如果下一行是空行（没有内容），就是卷
+                # elif reader.is_line_empty(reader.peek_line()):
+                elif reader.is_line_empty(_next_line):
+                    _is_volume = True
+
+            # 捶不了，只能推测了
+            if not _is_chapter and not _is_volume:
+                # 上段空行等于1或小于1（初始情况），推测更可能是继承，必须有关键字存在才是卷、章
+                if _last_empty <= 1:
+                    # 由于和实锤相同，跳过即可
+                    pass
+                # 上段空行大于1，推测更可能是卷、章
                 else:
-                    # 2. 好吧，命中了至少一个，认为必出一狼
-                    char = find_first_volume_or_chapter_char(line)
-                    if char == '卷':
-                        _is_volume = True
-                    elif char == '章':
-                        _is_chapter = True
-                    # 3. 如果下一行是空行（没有内容），就是卷
-                    # elif reader.is_line_empty(reader.peek_line()):
-                    elif reader.is_line_empty(_next_line):
-                        _is_volume = True
-
-                # 捶不了，只能推测了
-                if not _is_chapter and not _is_volume:
-                    # 上段空行等于1或小于1（初始情况），推测更可能是继承，必须有关键字存在才是卷、章
-                    if _last_empty <= 1:
-                        # 由于和实锤相同，跳过即可
-                        pass
-                    # 上段空行大于1，推测更可能是卷、章
+                    # s_pos = reader.tell()
+                    # # print(s_pos)
+                    # reader.read_continuous_content_lines()
+                    # e_pos = reader.tell()
+                    # print(e_pos)
+                    # skip_count = reader.read_continuous_empty_lines()
+                    if LocalBookCrawler._maybe_chapter(reader, s_pos, e_pos):
+                        return _title, "chapter", s_pos, e_pos
                     else:
-                        # s_pos = reader.tell()
-                        # # print(s_pos)
-                        # reader.read_continuous_content_lines()
-                        # e_pos = reader.tell()
-                        # print(e_pos)
-                        # skip_count = reader.read_continuous_empty_lines()
-                        if maybe_chapter(s_pos, e_pos):
-                            return _title, "chapter", s_pos, e_pos
-                        else:
-                            return _title, "volume", s_pos, e_pos
+                        return _title, "volume", s_pos, e_pos
 
-            else:
-                s_pos = reader.tell()
-                # print(s_pos)
-                reader.read_continuous_content_lines()
-                e_pos = reader.tell()
-            # print(e_pos)
-            # skip_count = reader.read_continuous_empty_lines()
-            # print("chapter" if _is_chapter else "volume" if _is_volume else "inherit")
-            # print("123" + reader.get_between_text(s_pos, e_pos))
-            # print("1234" + _title)
-            # print(f"12345 {s_pos}, {e_pos}")
-
-            return _title, "chapter" if _is_chapter else "volume" if _is_volume else "inherit", s_pos, e_pos
+        else:
+            s_pos = reader.tell()
+            # print(s_pos)
+            reader.read_continuous_content_lines()
+            e_pos = reader.tell()
+        # print(e_pos)
+        # skip_count = reader.read_continuous_empty_lines()
+        # print("chapter" if _is_chapter else "volume" if _is_volume else "inherit")
+        # print("123" + reader.get_between_text(s_pos, e_pos))
+        # print("1234" + _title)
+        # print(f"12345 {s_pos}, {e_pos}")
+
+        return _title, "chapter" if _is_chapter else "volume" if _is_volume else "inherit", s_pos, e_pos
 
+
+    @staticmethod
+    def _segment_blocks(reader: TxtBookReader, last_empty: int = 0, end_pos: int = None) \
+            -> Iterator[Tuple[str, str, int, int]]:
+        """
+        read content blocks from current position, until the end of file, or the first block starts at end_pos
+
+        :param reader:
+        :param last_empty: empty line count before the first block
+        :param end_pos: optional, must be the start of an empty line run (see _find_shard_boundary)
+        :return: title, "volume"/"chapter"/"inherit", start_pos, end_pos
+        """
+        while True:
+            yield LocalBookCrawler._read_content_block(reader, last_empty)
+            last_empty = reader.read_continuous_empty_lines()
+
+            if last_empty == 0 or (end_pos is not None and reader.tell() >= end_pos):
+                break
+
+    @staticmethod
+    def _find_shard_boundary(reader: TxtBookReader, pos: int) -> Union[int, None]:
+        """
+        find the first empty line run after pos which follows a content line
+
+        :param reader:
+        :param pos: any byte position
+        :return: start position of the empty line run, None if not found before the end of file
+        """
+        reader.seek(pos)
+        # 丢弃可能不完整的一行
+        reader.readline_binary()
+        last_empty = True
+        while True:
+            line_pos = reader.tell()
+            line = reader.readline_binary()
+            if not line:
+                return None
+            is_empty = reader.is_line_empty(line.decode(reader.encoding))
+            if is_empty and not last_empty:
+                return line_pos
+            last_empty = is_empty
+
+    @staticmethod
+    def _segment_blocks_parallel(reader: TxtBookReader, body_start: int, parse_workers: int,
+                                 heading_rules: str = None, executor: Executor = None) -> list:
+        """
+        split the body at empty line runs into shards, segment each shard in a worker process, and concat the blocks.
+        blocks never cross an empty line run, so the result is identical to _segment_blocks
+
+        :param reader: opened, positioned at body_start
+        :param body_start:
+        :param parse_workers: process count
+        :param heading_rules: heading rule file used by the workers
+        :param executor: optional process pool to reuse, otherwise one is created for this call
+        :return: same as _segment_blocks
+        """
+        reader.seek(0, io.SEEK_END)
+        file_end = reader.tell()
+        shard_size = max(1, (file_end - body_start) // parse_workers)
+
+        bounds = [body_start]
+        while len(bounds) < parse_workers:
+            boundary = LocalBookCrawler._find_shard_boundary(reader, bounds[-1] + shard_size)
+            if boundary is None:
+                break
+            bounds.append(boundary)
+        bounds.append(None)
+
+        # 子进程按偏移自己读取文件，只传回分块结果
+        pool = executor or ProcessPoolExecutor(max_workers=len(bounds) - 1)
+        try:
+            futures = [pool.submit(_segment_shard, reader.file_path, reader.encoding, bounds[i], bounds[i + 1],
+                                   heading_rules)
+                       for i in range(len(bounds) - 1)]
+            blocks = []
+            for future in futures:
+                blocks.extend(future.result())
+        finally:
+            if executor is None:
+                pool.shutdown()
+
+        reader.seek(file_end)
+        return blocks
+
+    @staticmethod
+    def _load_contents_scanner_handler(reader: TxtBookReader, title_input, author_input,
+                                       parse_workers: int = 1, heading_rules: str = None,
+                                       parse_executor: Executor = None) -> dict:
         result = {}
 
         # 1. [去尾] 去除尾部的宣传
@@ -217,29 +432,26 @@ class LocalBookCrawler(AbsBookCrawler):
         reader.read_continuous_empty_lines()
         # print(reader.tell())
 
-        def append_volume(_result, _title, _src_idx=None):
+        def append_volume(_toc: BookToc, _title, _src_idx=None):
             if _src_idx is None:
                 _src_idx = [0, 0]
-            if 'volumes' not in _result:
-                _result['volumes'] = []
-            _result['volumes'].append({
-                        "title": _title,
-                        "content": "",
-                        "srcIdx": _src_idx,
-                        "chapters": []
-                    })
-
-        def append_chapter(_result, _title, _src_idx):
-            if 'volumes' not in _result or len(_result["volumes"]) == 0:
-                append_volume(_result, "正文卷")
-            _result['volumes'][-1]['chapters'].append({
-                "title": _title,
-                "srcIdx": _src_idx,
-            })
+            _toc.append_volume(_title, _src_idx[0], _src_idx[1])
+
+        def append_chapter(_toc: BookToc, _title, _src_idx):
+            if len(_toc) == 0:
+                append_volume(_toc, "正文卷")
+            _toc.append_chapter(_title, _src_idx[0], _src_idx[1])
 
         # 主要内容
-        last_empty = 0
-        result['volumes'] = []
+        body_start = reader.tell()
+        if parse_workers > 1:
+            blocks = LocalBookCrawler._segment_blocks_parallel(reader, body_start, parse_workers, heading_rules,
+                                                               parse_executor)
+        else:
+            blocks = LocalBookCrawler._segment_blocks(reader)
+
+        toc = BookToc()
+        result['volumes'] = toc
         result["excerpt"] = ""
         # # [内容简介]
         # title, is_volume, start_pos, end_pos = read_content_block(last_empty)
@@ -269,11 +481,9 @@ class LocalBookCrawler(AbsBookCrawler):
 
         cnt: int = 0
         last_type = ""
-        while True:
+        for title, this_type, start_pos, end_pos in blocks:
             # print("Loop begin")
-            title, this_type, start_pos, end_pos = read_content_block(last_empty)
             end_pos = min(content_end_pos, end_pos)
-            last_empty = reader.read_continuous_empty_lines()
             done = False
 
             if cnt < 2:
@@ -283,7 +493,8 @@ class LocalBookCrawler(AbsBookCrawler):
                 # 开头的：明确包含简介等关键字，或者是短文，认为是简介
                 elif not result["excerpt"]:
                     if re.search(r"(内容|介绍|简介)", title) or (
-                            not title and not maybe_chapter(start_pos, end_pos) and end_pos - start_pos > 0):
+                            not title and not LocalBookCrawler._maybe_chapter(reader, start_pos, end_pos)
+                            and end_pos - start_pos > 0):
                         # print(start_pos)
 
                         result["excerpt"] += reader.get_between_text(start_pos, end_pos)
@@ -301,21 +512,19 @@ class LocalBookCrawler(AbsBookCrawler):
                         result["excerpt"] += title + reader.get_between_text(start_pos, end_pos)
                         last_type = "excerpt"
                     elif last_type == "volume":
-                        result["volumes"][-1]["srcIdx"][1] = end_pos
+                        toc.extend_last_volume(end_pos)
                         last_type = "volume"
                     else:
-                        result["volumes"][-1]["chapters"][-1]["srcIdx"][1] = end_pos
+                        toc.extend_last_chapter(end_pos)
                         last_type = "chapter"
 
                 elif this_type == "volume":
-                    append_volume(result, LocalBookCrawler.strip_empty_space(title), [start_pos, end_pos])
+                    append_volume(toc, LocalBookCrawler.strip_empty_space(title), [start_pos, end_pos])
                     last_type = "volume"
                 else:
-                    append_chapter(result, LocalBookCrawler.strip_empty_space(title), [start_pos, end_pos])
+                    append_chapter(toc, LocalBookCrawler.strip_empty_space(title), [start_pos, end_pos])
                     last_type = "chapter"
 
-            if last_empty == 0:
-                break
             cnt += 1
 
         return result
@@ -374,6 +583,113 @@ class LocalBookCrawler(AbsBookCrawler):
     def strip_empty_space(string: str):
         return string.strip()
 
+    def _source_key(self) -> Union[str, None]:
+        if not self.txt_reader.file_path:
+            return None
+        if is_zip_member_path(self.txt_reader.file_path):
+            return zip_member_key(self.txt_reader.file_path, self.zip_info)
+        stat = os.stat(self.txt_reader.file_path)
+        return f"{os.path.abspath(self.txt_reader.file_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+    def _cover_path(self) -> Union[str, None]:
+        # zip里的书不找封面
+        if not self.txt_reader.file_path or is_zip_member_path(self.txt_reader.file_path):
+            return None
+        return find_cover(self.txt_reader.file_path, self.folder_covers)
+
+    def _chapter_size(self, src_idx: list) -> int:
+        return src_idx[1] - src_idx[0]
+
+    def _source_info(self) -> dict:
+        return {
+            "source": self._source_key(),
+            "path": self.__source_path(self.txt_reader.file_path),
+            "encoding": self.txt_reader.encoding,
+        }
+
+    @staticmethod
+    def __source_path(file_path: str) -> str:
+        if is_zip_member_path(file_path):
+            archive_path, name = split_member_path(file_path)
+            return f"{os.path.abspath(archive_path)}{ZIP_MEMBER_SEPARATOR}{name}"
+        return os.path.abspath(file_path)
+
+    async def run_plan(self, plan: ImportPlan, logger: Logger = None, plan_path: str = None) -> bool:
+        """
+        execute a saved plan, chapters are read from its source file again without parsing.
+        with a journal, a plan already executed is skipped and an interrupted one resumes
+
+        :param plan:
+        :param logger:
+        :param plan_path: the plan file, progress (created book / volume ids) is saved back into it
+        :return:
+        """
+        path = plan.source_info.get("path")
+        if not path or not (zip_member_exists(path) if is_zip_member_path(path) else os.path.exists(path)):
+            logger and logger.write_err_log(f"{path}: source missing", "plan")
+            return False
+
+        with self.open(path):
+            self.txt_reader.encoding = plan.source_info["encoding"]
+            if self._source_key() != plan.source:
+                logger and logger.write_err_log(f"{path}: source changed, plan again", "plan")
+                return False
+            updater = next((updater for updater in self.book_updaters
+                            if self._target_name(updater) == plan.target), None)
+            journal_key = self._journal_key(updater) if updater else None
+            if journal_key and self.journal.is_done(journal_key):
+                logger and logger.write_log("plan", f"{path}: already imported", "plan")
+                return True
+            return await self.execute_plan(plan, updater, logger, plan_path)
+
+    async def retry_dead_letters(self, store: DeadLetterStore, logger: Logger = None) -> Tuple[int, int]:
+        """
+        replay dead-lettered chapters of the configured targets, read again from their source files.
+        entries of other targets, of changed / missing sources, or refused again are kept in the store
+
+        :param store:
+        :param logger:
+        :return: (replayed count, remaining count)
+        """
+        updaters = {}
+        for updater in self.book_updaters:
+            updater.create_session()
+            updaters[self._target_name(updater)] = updater
+
+        remaining = []
+        by_path = {}
+        for entry in store.entries():
+            if entry["target"] not in updaters or not entry.get("path"):
+                remaining.append(entry)
+            else:
+                by_path.setdefault(entry["path"], []).append(entry)
+
+        replayed = 0
+        for path, entries in by_path.items():
+            if not (zip_member_exists(path) if is_zip_member_path(path) else os.path.exists(path)):
+                remaining += entries
+                continue
+
+            with self.open(path):
+                self.txt_reader.encoding = entries[0]["encoding"]
+                if self._source_key() != entries[0]["source"]:
+                    logger and logger.write_err_log(f"{path}: source changed, dead letters kept", "dead letter")
+                    remaining += entries
+                    continue
+
+                for entry in entries:
+                    status, data = await updaters[entry["target"]].append_volume_chapter_stream(
+                        entry["book_id"], entry["volume_id"], lambda pending=entry: self._render_chapters([pending]))
+                    if status >= 400:
+                        entry["status"] = status
+                        entry["response"] = data
+                        remaining.append(entry)
+                    else:
+                        replayed += 1
+
+        store.replace(remaining)
+        return replayed, len(remaining)
+
     async def _get_book_basic_info(self) -> dict:
         return {
             "title": self.txt_book_data["title"],
@@ -391,7 +707,7 @@ class LocalBookCrawler(AbsBookCrawler):
 
     async def _get_one_chapter(self, src_idx: list) -> str:
         if src_idx and len(src_idx) >= 2:
-            return self.txt_reader.get_between_text(src_idx[0], src_idx[1])
+            return await self.txt_reader.aread_text_at(src_idx[0], src_idx[1])
         return ""
 
     @staticmethod
@@ -405,6 +721,28 @@ class LocalBookCrawler(AbsBookCrawler):
         return list(filter(lambda x: x != "", map(mp, outer_genres)))
 
 
+_shard_classifiers: dict = {}
+
+
+def _segment_shard(file_path: str, encoding: str, start_pos: int, end_pos: Union[int, None],
+                   heading_rules: Union[str, None]) -> list:
+    """
+    worker of LocalBookCrawler._segment_blocks_parallel, segment [start_pos, end_pos) of one file
+
+    :return: list of blocks
+    """
+    if heading_rules not in _shard_classifiers:
+        _shard_classifiers[heading_rules] = HeadingClassifier(heading_rules)
+
+    with TxtBookReader() as reader:
+        reader.open(file_path)
+        reader.encoding = encoding
+        reader.line_classifier = _shard_classifiers[heading_rules].classify
+        reader.seek(start_pos)
+        last_empty = reader.read_continuous_empty_lines()
+        return list(LocalBookCrawler._segment_blocks(reader, last_empty, end_pos))
+
+
 def list_txt(directory):
     return glob.glob(os.path.join(directory, '**/*.txt'), recursive=True)
 
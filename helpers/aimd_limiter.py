@@ -0,0 +1,112 @@
+import asyncio
+import time
+from typing import Union, Dict, List
+
+
+class AimdLimiter:
+    """
+    adaptive limit of in-flight requests to one host
+
+    additive increase: every success adds increase / limit, i.e. about +increase per round of requests
+    multiplicative decrease: 429 / any 5xx / timeout / latency above latency_factor * baseline multiplies the
+    limit by decrease, at most once per smoothed round trip, so one burst of slow responses counts once
+    baseline: per route (a cheap GET and a streamed chapter POST differ a lot), it follows a faster response
+    at once and drifts toward slower ones by baseline_decay, so it is a floor that ages;
+    latency is only judged after warm_up samples of the route
+    optional token bucket: at most rate requests per second, bursts up to burst
+    """
+    def __init__(self,
+                 initial: int = 4,
+                 minimum: int = 1,
+                 maximum: int = 64,
+                 increase: float = 1.0,
+                 decrease: float = 0.5,
+                 latency_factor: float = 3.0,
+                 baseline_decay: float = 0.05,
+                 warm_up: int = 5,
+                 rate: float = None,
+                 burst: int = None):
+        self.limit: float = float(initial)
+        self.minimum: int = minimum
+        self.maximum: int = maximum
+        self.increase: float = increase
+        self.decrease: float = decrease
+        self.latency_factor: float = latency_factor
+        self.baseline_decay: float = baseline_decay
+        self.warm_up: int = warm_up
+        self.in_flight: int = 0
+
+        # route -> [基准延迟, 样本数]
+        self.baselines: Dict[str, List[float]] = {}
+        self.smoothed_latency: Union[float, None] = None
+        self.last_decrease: float = 0.0
+
+        self.rate: Union[float, None] = rate
+        self.burst: float = float(burst if burst is not None else max(1, int(rate or 1)))
+        self.tokens: float = self.burst
+        self.token_time: float = time.monotonic()
+
+        self.__condition: Union[asyncio.Condition, None] = None
+
+    @property
+    def _condition(self) -> asyncio.Condition:
+        # 在事件循环里才创建
+        if self.__condition is None:
+            self.__condition = asyncio.Condition()
+        return self.__condition
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+        if self.rate:
+            await self.__take_token()
+
+    async def release(self, latency: float, status: Union[int, None], route: str = "") -> None:
+        """
+        return a slot and adjust the limit
+
+        :param latency: seconds the request took
+        :param status: response status, None for timeout / connection failure
+        :param route: kind of request (e.g. method + path pattern), latency is compared within a route
+        :return:
+        """
+        now = time.monotonic()
+        # 5xx（500/502/504等）说明服务器或网关已经过载，不能再加并发
+        congested = status is None or status == 429 or status >= 500
+        if not congested:
+            self.smoothed_latency = latency if self.smoothed_latency is None \
+                else self.smoothed_latency * 0.8 + latency * 0.2
+
+            baseline = self.baselines.get(route)
+            if baseline is None:
+                self.baselines[route] = [latency, 1]
+            else:
+                if baseline[1] >= self.warm_up and latency > baseline[0] * self.latency_factor:
+                    congested = True
+                # 更快的立即采用，更慢的缓慢跟随
+                baseline[0] = latency if latency < baseline[0] \
+                    else baseline[0] + (latency - baseline[0]) * self.baseline_decay
+                baseline[1] += 1
+
+        if congested:
+            if now - self.last_decrease > (self.smoothed_latency or latency):
+                self.limit = max(float(self.minimum), self.limit * self.decrease)
+                self.last_decrease = now
+        else:
+            self.limit = min(float(self.maximum), self.limit + self.increase / self.limit)
+
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def __take_token(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.token_time) * self.rate)
+            self.token_time = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
@@ -0,0 +1,90 @@
+import os
+import re
+from typing import List, Union
+
+DEFAULT_PATTERNS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "boilerplate_patterns.txt")
+
+
+def literals_to_regex(literals: List[str]) -> str:
+    """
+    regex of a prefix trie of the literals, so the regex engine never tries the same prefix twice
+
+    :param literals:
+    :return:
+    """
+    trie = {}
+    for literal in literals:
+        node = trie
+        for char in literal:
+            node = node.setdefault(char, {})
+        # ""表示在这里结束
+        node[""] = {}
+
+    def to_regex(node: dict) -> str:
+        ends = "" in node
+        branches = [re.escape(char) + to_regex(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        if len(branches) == 1 and not ends:
+            return branches[0]
+        return f"(?:{'|'.join(branches)}){'?' if ends else ''}"
+
+    return to_regex(trie)
+
+
+class BoilerplateFilter:
+    """
+    drop injected boilerplate lines (ads, site urls, ...) from chapter text with one combined regex
+
+    pattern file (utf-8 text), one pattern per line:
+        plain text: a line containing it is boilerplate
+        re:<regex>: a line the regex matches (search, case sensitive) is boilerplate
+        empty lines and lines starting with # are ignored
+    plain patterns are merged into a prefix trie, so hundreds of them cost about as much as one.
+    lines longer than max_length are never dropped, they are story text quoting the pattern
+    """
+    def __init__(self, patterns_path: str = None, max_length: int = 100):
+        self.patterns_path: str = patterns_path or DEFAULT_PATTERNS_PATH
+        self.max_length: int = max_length
+        literals = []
+        regexes = []
+        with open(self.patterns_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                if line.startswith("re:"):
+                    regexes.append(line[3:])
+                else:
+                    literals.append(line)
+
+        alternatives = regexes + ([literals_to_regex(literals)] if literals else [])
+        self.pattern_count: int = len(literals) + len(regexes)
+        self.pattern: Union[re.Pattern, None] = \
+            re.compile("|".join(f"(?:{regex})" for regex in alternatives)) if alternatives else None
+
+    def strip(self, text: str) -> str:
+        """
+        one pass over the text, lines containing a match are removed together with their line break
+
+        :param text:
+        :return:
+        """
+        if self.pattern is None:
+            return text
+        match = self.pattern.search(text)
+        if match is None:
+            return text
+
+        parts = []
+        pos = 0
+        while match is not None:
+            line_start = text.rfind("\n", 0, match.start()) + 1
+            line_end = text.find("\n", match.end())
+            line_end = len(text) if line_end < 0 else line_end + 1
+            if len(text[line_start:line_end].strip()) <= self.max_length:
+                parts.append(text[pos:line_start])
+                pos = line_end
+            match = self.pattern.search(text, line_end)
+        parts.append(text[pos:])
+        return "".join(parts)
@@ -0,0 +1,155 @@
+from array import array
+from typing import Union, List, Iterator
+
+
+class BookToc:
+    """
+    compact table of contents of a book
+    volumes and chapters are kept in parallel offset arrays, titles are utf-8 encoded in one shared buffer.
+    indexing returns light views that read like the dicts of _get_contents_info:
+        volume["title"], volume["srcIdx"], volume["chapters"], chapter["title"], chapter["srcIdx"]
+    """
+    __slots__ = ("volume_starts", "volume_ends", "volume_titles", "volume_first_chapters",
+                 "chapter_starts", "chapter_ends", "chapter_titles",
+                 "title_buffer", "title_offsets")
+
+    def __init__(self):
+        self.volume_starts: array = array('q')
+        self.volume_ends: array = array('q')
+        self.volume_titles: array = array('q')
+        # 卷的第一章在chapter数组中的下标，章节总是追加到最后一卷，所以每卷的章节是连续的
+        self.volume_first_chapters: array = array('q')
+
+        self.chapter_starts: array = array('q')
+        self.chapter_ends: array = array('q')
+        self.chapter_titles: array = array('q')
+
+        self.title_buffer: bytearray = bytearray()
+        self.title_offsets: array = array('q', [0])
+
+    def __len__(self) -> int:
+        return len(self.volume_starts)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union["TocVolume", List["TocVolume"]]:
+        if isinstance(index, slice):
+            return [TocVolume(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("volume index out of range")
+        return TocVolume(self, index)
+
+    def __iter__(self) -> Iterator["TocVolume"]:
+        for i in range(len(self)):
+            yield TocVolume(self, i)
+
+    def chapter_count(self) -> int:
+        return len(self.chapter_starts)
+
+    def append_volume(self, title: str, start_pos: int = 0, end_pos: int = 0) -> None:
+        self.volume_starts.append(start_pos)
+        self.volume_ends.append(end_pos)
+        self.volume_titles.append(self._add_title(title))
+        self.volume_first_chapters.append(len(self.chapter_starts))
+
+    def append_chapter(self, title: str, start_pos: int, end_pos: int) -> None:
+        """
+        append a chapter to the last volume
+
+        :param title:
+        :param start_pos:
+        :param end_pos:
+        :return:
+        """
+        if len(self) == 0:
+            raise IndexError("append chapter to a toc without volume")
+        self.chapter_starts.append(start_pos)
+        self.chapter_ends.append(end_pos)
+        self.chapter_titles.append(self._add_title(title))
+
+    def extend_last_volume(self, end_pos: int) -> None:
+        self.volume_ends[-1] = end_pos
+
+    def extend_last_chapter(self, end_pos: int) -> None:
+        self.chapter_ends[-1] = end_pos
+
+    def title(self, title_index: int) -> str:
+        return self.title_buffer[self.title_offsets[title_index]:self.title_offsets[title_index + 1]].decode('utf-8')
+
+    def volume_chapter_range(self, volume_index: int) -> range:
+        first = self.volume_first_chapters[volume_index]
+        last = self.volume_first_chapters[volume_index + 1] if volume_index + 1 < len(self) \
+            else len(self.chapter_starts)
+        return range(first, last)
+
+    def _add_title(self, title: str) -> int:
+        self.title_buffer += title.encode('utf-8')
+        self.title_offsets.append(len(self.title_buffer))
+        return len(self.title_offsets) - 2
+
+
+class TocVolume:
+    """
+    view of one volume in BookToc
+    """
+    __slots__ = ("toc", "index")
+
+    def __init__(self, toc: BookToc, index: int):
+        self.toc: BookToc = toc
+        self.index: int = index
+
+    def __getitem__(self, key: str):
+        if key == "title":
+            return self.toc.title(self.toc.volume_titles[self.index])
+        if key == "srcIdx":
+            return [self.toc.volume_starts[self.index], self.toc.volume_ends[self.index]]
+        if key == "chapters":
+            return TocChapterList(self.toc, self.toc.volume_chapter_range(self.index))
+        raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in ("title", "srcIdx", "chapters")
+
+
+class TocChapterList:
+    """
+    view of the chapters of one volume in BookToc
+    """
+    __slots__ = ("toc", "indices")
+
+    def __init__(self, toc: BookToc, indices: range):
+        self.toc: BookToc = toc
+        self.indices: range = indices
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union["TocChapter", List["TocChapter"]]:
+        if isinstance(index, slice):
+            return [TocChapter(self.toc, i) for i in self.indices[index]]
+        return TocChapter(self.toc, self.indices[index])
+
+    def __iter__(self) -> Iterator["TocChapter"]:
+        for i in self.indices:
+            yield TocChapter(self.toc, i)
+
+
+class TocChapter:
+    """
+    view of one chapter in BookToc
+    """
+    __slots__ = ("toc", "index")
+
+    def __init__(self, toc: BookToc, index: int):
+        self.toc: BookToc = toc
+        self.index: int = index
+
+    def __getitem__(self, key: str):
+        if key == "title":
+            return self.toc.title(self.toc.chapter_titles[self.index])
+        if key == "srcIdx":
+            return [self.toc.chapter_starts[self.index], self.toc.chapter_ends[self.index]]
+        raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in ("title", "srcIdx")
@@ -0,0 +1,115 @@
+import json
+import os
+import re
+import time
+import unicodedata
+from typing import Dict, Tuple, Union
+
+_NOISE = re.compile(r"[\s《》<>「」『』\"'“”‘’]+")
+
+
+def normalize(text: str) -> str:
+    """
+    normalized title / author used as catalog key: NFKC, case folded, without spaces and title quotes
+
+    :param text:
+    :return:
+    """
+    return _NOISE.sub("", unicodedata.normalize("NFKC", text or "")).casefold()
+
+
+def author_name(author: Union[dict, str, None]) -> str:
+    if isinstance(author, dict):
+        return author.get("name", "")
+    return author or ""
+
+
+class CatalogSnapshot:
+    """
+    local snapshot of the books of one target, indexed by normalized (title, author)
+
+    synced by paging through the books collection; when books carry a modified time, later syncs only ask
+    for books modified after the newest one seen (the cursor). optionally persisted as json.
+    within max_age seconds of a successful sync the snapshot is fresh: a book missing from it does not exist
+    """
+    def __init__(self, file_path: str = None, max_age: float = 3600.0):
+        self.file_path: Union[str, None] = file_path
+        self.max_age: float = max_age
+        # 上次成功同步的时间（monotonic），从文件加载的快照未同步前不算新
+        self.synced_at: Union[float, None] = None
+        # id -> {"id", "title", "author"}
+        self.entries: Dict[int, dict] = {}
+        self.index: Dict[Tuple[str, str], int] = {}
+        self.cursor: Union[str, None] = None
+        self.load()
+
+    def load(self) -> None:
+        if not self.file_path or not os.path.exists(self.file_path):
+            return
+        with open(self.file_path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        self.cursor = data.get("cursor")
+        for entry in data.get("books", []):
+            self.add(entry)
+
+    def save(self) -> None:
+        if not self.file_path:
+            return
+        tmp_path = self.file_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({"cursor": self.cursor, "books": list(self.entries.values())}, file, ensure_ascii=False)
+        os.replace(tmp_path, self.file_path)
+
+    def add(self, book: dict) -> None:
+        """
+        add or update a book (a summary or a full book)
+
+        :param book:
+        :return:
+        """
+        old = self.entries.get(book["id"])
+        if old is not None:
+            self.index.pop((normalize(old["title"]), normalize(old["author"])), None)
+        entry = {"id": book["id"], "title": book.get("title", ""), "author": author_name(book.get("author"))}
+        self.entries[book["id"]] = entry
+        self.index[(normalize(entry["title"]), normalize(entry["author"]))] = book["id"]
+
+    def lookup(self, title: str, author: str) -> Union[int, None]:
+        return self.index.get((normalize(title), normalize(author)))
+
+    def is_fresh(self) -> bool:
+        return self.synced_at is not None and time.monotonic() - self.synced_at < self.max_age
+
+    async def sync(self, updater, per_page: int = 100) -> bool:
+        """
+        page through the books of the target, from the cursor if there is one
+
+        :param updater: BookUpdater of the target
+        :param per_page:
+        :return: success or not
+        """
+        page = 1
+        seen = set()
+        cursor = self.cursor
+        while True:
+            status, books = await updater.list_books(page, per_page, self.cursor)
+            if status != 200 or not isinstance(books, list):
+                return False
+
+            # 服务器忽略分页参数时，每页都一样
+            new_books = [book for book in books if book["id"] not in seen]
+            for book in new_books:
+                seen.add(book["id"])
+                self.add(book)
+                modified = book.get("modified_gmt") or book.get("modified")
+                if modified and (cursor is None or modified > cursor):
+                    cursor = modified
+
+            if len(books) < per_page or not new_books:
+                break
+            page += 1
+
+        self.cursor = cursor
+        self.synced_at = time.monotonic()
+        self.save()
+        return True
@@ -0,0 +1,212 @@
+import io
+import shutil
+import tempfile
+import zlib
+from bisect import bisect_right
+from typing import BinaryIO, Union, List, Tuple, Any
+
+try:
+    # 可选依赖，只有读取.zst时需要
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_SUFFIXES = (".gz",)
+ZSTD_SUFFIXES = (".zst", ".zstd")
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def is_compressed_path(path: str) -> bool:
+    return path.lower().endswith(GZIP_SUFFIXES + ZSTD_SUFFIXES)
+
+
+class SeekableDecompressedFile(io.RawIOBase):
+    """
+    read only, seekable view of the decompressed content of a .gz file
+
+    while decompressing forward, a checkpoint (output offset, input offset, decompressor state) is recorded
+    every checkpoint_span bytes of output, so the first full pass (e.g. the first scan) builds the index,
+    and a later read decompresses from the nearest checkpoint before it only.
+    zstd decompressors cannot be copied (a single frame .zst would only have a checkpoint at 0),
+    see spool_zstd instead
+    """
+    def __init__(self, file_path: str, checkpoint_span: int = 4 * 1024 * 1024, input_chunk: int = 64 * 1024):
+        super().__init__()
+        self.file_path: str = file_path
+        self.checkpoint_span: int = checkpoint_span
+        self.input_chunk: int = input_chunk
+        self.source: BinaryIO = open(file_path, 'rb')
+        # (输出偏移, 输入偏移, 解压器状态) 按输出偏移递增；状态为None表示从新的gzip成员开始
+        self.checkpoints: List[Tuple[int, int, Any]] = [(0, 0, None)]
+        self.checkpoint_offsets: List[int] = [0]
+        self.size: Union[int, None] = None
+
+        self.pos: int = 0
+        # 解码状态：下一个输出字节的偏移，已读取但未送入解压器的输入
+        self.decompressor: Any = self.__new_decompressor()
+        self.out_pos: int = 0
+        self.pending: bytes = b""
+        self.eof: bool = False
+        # 最近解出的一段，[buffer_start, out_pos)
+        self.buffer: bytes = b""
+        self.buffer_start: int = 0
+
+    @staticmethod
+    def __new_decompressor() -> Any:
+        return zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        elif whence == io.SEEK_END:
+            self.pos = self.__total_size() + offset
+        else:
+            raise ValueError(f"invalid whence: {whence}")
+        self.pos = max(0, self.pos)
+        return self.pos
+
+    def readinto(self, buffer) -> int:
+        data = self.__read_at(self.pos, len(buffer))
+        buffer[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+    def close(self) -> None:
+        if not self.closed:
+            self.source.close()
+            self.checkpoints = []
+            self.buffer = b""
+        super().close()
+
+    def __total_size(self) -> int:
+        if self.size is None:
+            if self.out_pos < self.checkpoints[-1][0]:
+                self.__restore(self.checkpoints[-1])
+            while not self.eof:
+                self.__decode()
+        return self.size
+
+    def __read_at(self, pos: int, size: int) -> bytes:
+        if self.size is not None and pos >= self.size:
+            return b""
+        if pos < self.buffer_start:
+            self.__restore(self.checkpoints[bisect_right(self.checkpoint_offsets, pos) - 1])
+        elif pos > self.out_pos:
+            # 往前跳得远时，直接从中间的检查点开始
+            checkpoint = self.checkpoints[bisect_right(self.checkpoint_offsets, pos) - 1]
+            if checkpoint[0] > self.out_pos:
+                self.__restore(checkpoint)
+
+        parts = []
+        while size > 0:
+            if self.buffer_start <= pos < self.out_pos:
+                part = self.buffer[pos - self.buffer_start:pos - self.buffer_start + size]
+                parts.append(part)
+                pos += len(part)
+                size -= len(part)
+            elif self.eof:
+                break
+            else:
+                self.__decode()
+        return b"".join(parts)
+
+    def __restore(self, checkpoint: Tuple[int, int, Any]) -> None:
+        out_pos, in_pos, state = checkpoint
+        self.source.seek(in_pos)
+        self.decompressor = self.__new_decompressor() if state is None else state.copy()
+        self.out_pos = out_pos
+        self.pending = b""
+        self.eof = False
+        self.buffer = b""
+        self.buffer_start = out_pos
+
+    def __decode(self) -> None:
+        """
+        decompress the next block into buffer, record checkpoints on the way
+
+        :return:
+        """
+        if not self.pending:
+            self.pending = self.source.read(self.input_chunk)
+            if not self.pending:
+                self.__finish()
+                return
+
+        # 正好停在检查点上
+        limit = self.checkpoint_span - self.out_pos % self.checkpoint_span
+        out = self.decompressor.decompress(self.pending, limit)
+        self.pending = self.decompressor.unconsumed_tail
+
+        self.buffer = out
+        self.buffer_start = self.out_pos
+        self.out_pos += len(out)
+
+        if self.decompressor.eof:
+            # 多成员gzip：下一段从新的解压器开始。成员结束时剩余的输入在unused_data里，
+            # 带max_length解压时unconsumed_tail可能还是同一段，不能再拼上
+            self.pending = self.decompressor.unused_data
+            if not self.pending:
+                self.pending = self.source.read(self.input_chunk)
+            if not self.pending.startswith(GZIP_MAGIC):
+                # 结尾的填充之类
+                self.__finish()
+                return
+            self.decompressor = self.__new_decompressor()
+            self.__add_checkpoint(None)
+        elif self.out_pos % self.checkpoint_span == 0 and out:
+            self.__add_checkpoint(self.decompressor.copy())
+
+    def __add_checkpoint(self, state: Any) -> None:
+        if self.out_pos > self.checkpoints[-1][0]:
+            self.checkpoints.append((self.out_pos, self.source.tell() - len(self.pending), state))
+            self.checkpoint_offsets.append(self.out_pos)
+
+    def __finish(self) -> None:
+        self.eof = True
+        self.size = self.out_pos
+
+
+def spool_zstd(file_path: str, spool_dir: str = None) -> BinaryIO:
+    """
+    decompress a whole .zst file (every frame) into an anonymous temporary file,
+    so reads at any offset are plain seeks, whatever the frame layout
+
+    :param file_path: .zst file
+    :param spool_dir: optional directory of the temporary file, default the system temp directory
+    :return: binary file of the decompressed content, positioned at 0, removed when closed
+    """
+    if zstandard is None:
+        raise ImportError(f"reading {file_path} requires the zstandard package")
+    spooled = tempfile.TemporaryFile(dir=spool_dir)
+    try:
+        with open(file_path, 'rb') as source, \
+                zstandard.ZstdDecompressor().stream_reader(source, read_across_frames=True) as reader:
+            shutil.copyfileobj(reader, spooled, 1024 * 1024)
+        spooled.seek(0)
+    except BaseException:
+        spooled.close()
+        raise
+    return spooled
+
+
+def open_seekable_compressed(file_path: str, checkpoint_span: int = 4 * 1024 * 1024) -> BinaryIO:
+    """
+    :param file_path: .gz or .zst file
+    :param checkpoint_span: bytes of decompressed output between checkpoints (.gz)
+    :return: seekable binary file of the decompressed content: .gz decompressed on demand from checkpoints,
+             .zst spooled to a temporary file first
+    """
+    if file_path.lower().endswith(ZSTD_SUFFIXES):
+        return spool_zstd(file_path)
+    return io.BufferedReader(SeekableDecompressedFile(file_path, checkpoint_span), 1024 * 1024)
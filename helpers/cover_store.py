@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+from typing import Dict, Union
+
+COVER_SUFFIXES = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def find_cover(book_path: str, folder_cover: bool = False) -> Union[str, None]:
+    """
+    cover image of a local book: an image with the same stem next to it (book.txt -> book.jpg),
+    optionally cover.* in the same directory.
+    only the candidate names are probed, the directory is never listed (a flat library may hold many books)
+
+    :param book_path: txt file, compressed txt file
+    :param folder_cover: also use cover.* of the directory, shared by every book in it
+    :return: image path, None if there is none
+    """
+    directory = os.path.dirname(os.path.abspath(book_path))
+    stem = os.path.basename(book_path)
+    # book.txt.gz -> book
+    for suffix in (".gz", ".zst", ".zstd", ".txt"):
+        if stem.lower().endswith(suffix):
+            stem = stem[:-len(suffix)]
+
+    stems = [stem, "cover", "Cover", "COVER"] if folder_cover else [stem]
+    for base in stems:
+        for suffix in COVER_SUFFIXES:
+            for ext in (suffix, suffix.upper()):
+                path = os.path.join(directory, base + ext)
+                if os.path.isfile(path):
+                    return path
+    return None
+
+
+def file_sha256(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CoverHashStore:
+    """
+    content hashes of the covers uploaded, so unchanged covers are not sent again.
+    key: target + book id. persisted as an append-only json lines file when a file path is given,
+    one line per upload, compacted when opened and closed
+    """
+    def __init__(self, file_path: str = None):
+        self.file_path: Union[str, None] = file_path
+        self.hashes: Dict[str, str] = {}
+        self.file = None
+        if file_path:
+            self.load()
+            self.compact()
+            self.file = open(file_path, 'a', encoding='utf-8')
+
+    def load(self) -> None:
+        if not os.path.exists(self.file_path):
+            return
+        with open(self.file_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                    self.hashes[record["key"]] = record["hash"]
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    # 进程被杀时可能留下写了一半的行
+                    continue
+
+    def compact(self) -> None:
+        tmp_path = self.file_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            for key, content_hash in self.hashes.items():
+                file.write(json.dumps({"key": key, "hash": content_hash}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.file_path)
+
+    @staticmethod
+    def key(target: str, book_id: int) -> str:
+        return f"{target}|{book_id}"
+
+    def get(self, target: str, book_id: int) -> Union[str, None]:
+        return self.hashes.get(self.key(target, book_id))
+
+    def set(self, target: str, book_id: int, content_hash: str) -> None:
+        key = self.key(target, book_id)
+        self.hashes[key] = content_hash
+        if self.file is not None:
+            self.file.write(json.dumps({"key": key, "hash": content_hash}, ensure_ascii=False) + "\n")
+            self.file.flush()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.compact()
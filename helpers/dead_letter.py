@@ -0,0 +1,50 @@
+import json
+import os
+from typing import List
+
+
+class DeadLetterStore:
+    """
+    persistent json lines store of chapters the server refused, to be replayed later
+
+    entry:
+        target: base url + namespace
+        book_id, volume_id, volume: volume title, title: chapter title, srcIdx: [start, end]
+        status, response: the refusing response
+        plus source info given by the crawler (e.g. source, path, encoding)
+    """
+    def __init__(self, file_path: str):
+        self.file_path: str = file_path
+
+    def add(self, entry: dict) -> None:
+        with open(self.file_path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(entry, ensure_ascii=False, default=repr) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+    def entries(self) -> List[dict]:
+        if not os.path.exists(self.file_path):
+            return []
+        result = []
+        with open(self.file_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    result.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return result
+
+    def replace(self, entries: List[dict]) -> None:
+        """
+        atomically replace all entries, used after a replay
+
+        :param entries: remaining entries
+        :return:
+        """
+        tmp_path = self.file_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            for entry in entries:
+                file.write(json.dumps(entry, ensure_ascii=False, default=repr) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.file_path)
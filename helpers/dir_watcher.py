@@ -0,0 +1,207 @@
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Tuple, Iterator, List, AsyncIterator, Callable, Set, Union
+
+from helpers.library_scheduler import BookFilter
+from helpers.zip_source import is_zip_member_path, split_member_path
+
+
+class DirWatcher:
+    """
+    poll a directory tree with os.scandir, report new / modified books once they stop changing
+
+    books are the files the library walk would import (same BookFilter: suffixes, zip archives, include / exclude).
+    a file is identified by (inode, size, mtime_ns), and is ready when that key has been stable
+    for settle seconds (or its mtime is already older than that). a ready zip archive is reported as its members,
+    and is handled once all of them are marked done
+    with a state file, the handled versions survive a restart: an append-only json lines file,
+    one line per handled file, compacted when opened and closed
+    """
+    def __init__(self,
+                 directory: str,
+                 recursive: bool = False,
+                 interval: float = 5.0,
+                 settle: float = 10.0,
+                 book_filter: BookFilter = None,
+                 state_path: str = None):
+        self.directory: str = directory
+        self.recursive: bool = recursive
+        self.interval: float = interval
+        self.settle: float = settle
+        self.book_filter: BookFilter = book_filter or BookFilter()
+        # archive path -> members reported but not marked done yet
+        self.archive_members: Dict[str, Set[str]] = {}
+        # path -> key of the last handled version
+        self.stat_cache: Dict[str, Tuple[int, int, int]] = {}
+        # path -> (key, first time this key was seen)
+        self.pending: Dict[str, Tuple[Tuple[int, int, int], float]] = {}
+        self.state_path: Union[str, None] = state_path
+        # 处理过但不写入状态文件的（失败的书之类），重启后重新报告；压缩包的成员也计入
+        self.unsaved: Set[str] = set()
+        self.state_file = None
+        if state_path:
+            self.load_state()
+            self.compact_state()
+            self.state_file = open(state_path, 'a', encoding='utf-8')
+
+    def load_state(self) -> None:
+        if not os.path.exists(self.state_path):
+            return
+        with open(self.state_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                    self.stat_cache[record["path"]] = tuple(record["key"])
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    # 进程被杀时可能留下写了一半的行
+                    continue
+
+    def compact_state(self) -> None:
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            for path, key in self.stat_cache.items():
+                if path in self.unsaved:
+                    continue
+                file.write(json.dumps({"path": path, "key": list(key)}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.state_path)
+
+    def close(self) -> None:
+        if self.state_file is not None:
+            self.state_file.close()
+            self.state_file = None
+            self.compact_state()
+
+    def scan(self) -> Iterator[Tuple[str, Tuple[int, int, int]]]:
+        """
+        walk the directory
+
+        :return: (path, (inode, size, mtime_ns)) of every book file and zip archive
+        """
+        stack = [self.directory]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    for entry in it:
+                        rel_path = os.path.relpath(entry.path, self.directory).replace(os.sep, "/")
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if self.recursive and not self.book_filter.is_excluded(rel_path, entry.name):
+                                    stack.append(entry.path)
+                            elif self.is_candidate(rel_path, entry.name) and entry.is_file():
+                                stat = entry.stat()
+                                yield entry.path, (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+                        except OSError:
+                            # 扫描途中被删除之类
+                            continue
+            except OSError:
+                continue
+
+    def is_candidate(self, rel_path: str, name: str) -> bool:
+        if self.book_filter.is_archive(name):
+            return not self.book_filter.is_excluded(rel_path, name)
+        return self.book_filter.is_book(rel_path, name)
+
+    def expand(self, path: str) -> List[str]:
+        """
+        :param path: a ready file
+        :return: the file, or the members of an archive (none left: the archive is marked done right away)
+        """
+        if not self.book_filter.is_archive(os.path.basename(path)):
+            return [path]
+        if path in self.archive_members:
+            return list(self.archive_members[path])
+        rel_path = os.path.relpath(path, self.directory).replace(os.sep, "/")
+        members = [member_path for member_path, _ in self.book_filter.archive_members(path, rel_path)]
+        if not members:
+            self.mark_done(path)
+            return []
+        self.archive_members[path] = set(members)
+        return members
+
+    def poll(self) -> List[str]:
+        """
+        scan once
+
+        :return: books which are new or modified since last handled and have settled
+        """
+        now = time.time()
+        ready = []
+        seen = set()
+        for path, key in self.scan():
+            seen.add(path)
+            if self.stat_cache.get(path) == key:
+                self.pending.pop(path, None)
+                continue
+
+            if path not in self.pending or self.pending[path][0] != key:
+                self.pending[path] = (key, now)
+                # 压缩包变了，成员重新列出，上次的失败不再算数
+                self.archive_members.pop(path, None)
+                self.unsaved.discard(path)
+
+            first_seen = self.pending[path][1]
+            if now - first_seen >= self.settle or now - key[2] / 1e9 >= self.settle:
+                ready += self.expand(path)
+
+        # 删除了的文件
+        for path in list(self.pending):
+            if path not in seen:
+                del self.pending[path]
+        for path in list(self.stat_cache):
+            if path not in seen:
+                del self.stat_cache[path]
+        for path in list(self.archive_members):
+            if path not in self.pending:
+                del self.archive_members[path]
+        self.unsaved &= seen
+
+        return sorted(ready)
+
+    def mark_done(self, path: str, persist: bool = True) -> None:
+        """
+        record the version of a ready file as handled, it will be reported again only after it changes
+
+        :param path: a file or an archive member
+        :param persist: also write it to the state file; otherwise it is reported again after a restart
+        :return:
+        """
+        if is_zip_member_path(path):
+            archive_path, _ = split_member_path(path)
+            remaining = self.archive_members.get(archive_path)
+            if remaining is None:
+                return
+            remaining.discard(path)
+            if not persist:
+                self.unsaved.add(archive_path)
+            if remaining:
+                return
+            del self.archive_members[archive_path]
+            path = archive_path
+            persist = archive_path not in self.unsaved
+        key, _ = self.pending.pop(path, (None, None))
+        if key is not None:
+            self.stat_cache[path] = key
+            if not persist:
+                self.unsaved.add(path)
+                return
+            self.unsaved.discard(path)
+            if self.state_file is not None:
+                self.state_file.write(json.dumps({"path": path, "key": list(key)}, ensure_ascii=False) + "\n")
+                self.state_file.flush()
+
+    async def watch(self, stop: Callable[[], bool] = None) -> AsyncIterator[List[str]]:
+        """
+        poll until stop() returns true. the scan runs in the default executor, so uploads in flight are not stalled;
+        it never overlaps mark_done, the generator is suspended while the caller handles a batch
+
+        :param stop: optional, checked before every poll
+        :return: async generator of ready file batches
+        """
+        loop = asyncio.get_running_loop()
+        while stop is None or not stop():
+            ready = await loop.run_in_executor(None, self.poll)
+            if ready:
+                yield ready
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,123 @@
+import heapq
+import json
+import os
+import re
+import zlib
+from collections import Counter
+from typing import Iterable, List, Tuple, Union, Dict
+
+_NOISE = re.compile(r"[\W_]+")
+
+
+def book_sketch(texts: Iterable[str], k: int = 128, shingle: int = 5) -> List[int]:
+    """
+    bottom-k MinHash sketch of some texts: the k smallest crc32 hashes of all character shingles.
+    whitespace and punctuation are ignored, so re-formatted copies still collide
+
+    :param texts: e.g. sampled chapter contents
+    :param k: sketch size
+    :param shingle: shingle length in characters
+    :return: sorted hashes (at most k)
+    """
+    hashes = set()
+    for text in texts:
+        data = _NOISE.sub("", text).encode('utf-16-le')
+        width = shingle * 2
+        hashes.update(zlib.crc32(data[i:i + width]) for i in range(0, len(data) - width + 1, 2))
+    return sorted(heapq.nsmallest(k, hashes))
+
+
+def content_hash(text: str, length: int = 32) -> int:
+    """
+    crc32 of the first characters of a text, whitespace and punctuation ignored
+
+    :param text:
+    :param length: characters hashed
+    :return:
+    """
+    return zlib.crc32(_NOISE.sub("", text)[:length].encode('utf-16-le'))
+
+
+def sketch_similarity(a: List[int], b: List[int]) -> float:
+    """
+    estimate jaccard similarity of two bottom-k sketches
+
+    :param a:
+    :param b:
+    :return: 0 ~ 1
+    """
+    k = min(len(a), len(b))
+    if k == 0:
+        return 0.0
+    union = heapq.nsmallest(k, set(a) | set(b))
+    sa, sb = set(a), set(b)
+    return sum(1 for h in union if h in sa and h in sb) / len(union)
+
+
+class FingerprintIndex:
+    """
+    local index of imported book sketches, persisted as json lines (later lines of the same path win).
+    an inverted hash -> entries map narrows candidates, so lookup stays cheap on large libraries
+    """
+    def __init__(self, file_path: str, threshold: float = 0.8):
+        self.file_path: str = file_path
+        self.threshold: float = threshold
+        self.entries: Dict[str, dict] = {}
+        self.postings: Dict[int, set] = {}
+        self.load()
+
+    def load(self) -> None:
+        if not os.path.exists(self.file_path):
+            return
+        with open(self.file_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    self.__put(json.loads(line))
+
+    def __put(self, entry: dict) -> None:
+        old = self.entries.get(entry["path"])
+        if old is not None:
+            for h in old["sketch"]:
+                self.postings[h].discard(entry["path"])
+        self.entries[entry["path"]] = entry
+        for h in entry["sketch"]:
+            self.postings.setdefault(h, set()).add(entry["path"])
+
+    def find_duplicate(self, sketch: List[int], exclude_path: str = None) -> Union[Tuple[dict, float], None]:
+        """
+        find the most similar indexed book above threshold
+
+        :param sketch: sketch of the book to check
+        :param exclude_path: ignore the entry of this path (the book itself)
+        :return: (entry, similarity) or None
+        """
+        counter = Counter()
+        for h in sketch:
+            counter.update(self.postings.get(h, ()))
+        counter.pop(exclude_path, None)
+
+        # 相似度达到阈值的，共享的哈希数不会太少
+        min_shared = max(1, int(len(sketch) * self.threshold / 2))
+        best = None
+        for path, shared in counter.most_common():
+            if shared < min_shared:
+                break
+            similarity = sketch_similarity(sketch, self.entries[path]["sketch"])
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (self.entries[path], similarity)
+        return best
+
+    def add(self, path: str, title: str, author: str, sketch: List[int]) -> None:
+        """
+        add (or replace) a book and append it to the index file
+
+        :param path: source file path
+        :param title:
+        :param author:
+        :param sketch:
+        :return:
+        """
+        entry = {"path": path, "title": title, "author": author, "sketch": sketch}
+        self.__put(entry)
+        with open(self.file_path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(entry, ensure_ascii=False) + "\n")
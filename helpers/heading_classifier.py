@@ -0,0 +1,68 @@
+import json
+import os
+import re
+from typing import Iterator, Tuple, Union
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "heading_rules.json")
+
+
+class HeadingClassifier:
+    """
+    classify volume / chapter headings with one regex compiled from rule packs
+
+    rule file (json):
+        max_length: only lines not longer than this can be headings
+        prefix: regex allowed before a heading (indent, opening brackets)
+        placeholders: name -> regex, referenced in rules as {name}
+        packs: list of {name, volume: [regex], chapter: [regex], enabled}, earlier packs take precedence
+    """
+    def __init__(self, rules_path: str = None):
+        self.rules_path: str = rules_path or DEFAULT_RULES_PATH
+        with open(self.rules_path, 'r', encoding='utf-8') as file:
+            rules = json.load(file)
+
+        self.max_length: int = rules.get("max_length", 50)
+        self.group_kinds: dict = {}
+        self.pattern: re.Pattern = self.__compile(rules)
+
+    def __compile(self, rules: dict) -> re.Pattern:
+        placeholders = rules.get("placeholders", {})
+
+        def expand(rule: str) -> str:
+            for name, regex in placeholders.items():
+                rule = rule.replace("{" + name + "}", regex)
+            return rule
+
+        alternatives = []
+        for i, pack in enumerate(rules["packs"]):
+            if not pack.get("enabled", True):
+                continue
+            for kind in ("volume", "chapter"):
+                for j, rule in enumerate(pack.get(kind, [])):
+                    group = f"{kind[0]}{i}_{j}"
+                    self.group_kinds[group] = kind
+                    alternatives.append(f"(?P<{group}>{expand(rule)})")
+
+        # 行首 + 长度限制 + 前缀 + 任意一条规则
+        return re.compile(f"^(?=[^\\n]{{0,{self.max_length}}}$){rules.get('prefix', '')}(?:{'|'.join(alternatives)})",
+                          re.MULTILINE | re.IGNORECASE)
+
+    def classify(self, line: str) -> Union[str, None]:
+        """
+        classify a single line
+
+        :param line:
+        :return: "volume", "chapter" or None
+        """
+        match = self.pattern.match(line.rstrip("\r\n"))
+        return self.group_kinds[match.lastgroup] if match else None
+
+    def find_headings(self, text: str) -> Iterator[Tuple[int, str]]:
+        """
+        classify all lines of a decoded text in one pass
+
+        :param text: decoded text, lines separated by "\\n"
+        :return: (character offset of the heading line, "volume" or "chapter")
+        """
+        for match in self.pattern.finditer(text):
+            yield match.start(), self.group_kinds[match.lastgroup]
@@ -0,0 +1,134 @@
+import json
+import os
+from typing import Dict, Union, List
+
+
+class ImportJournal:
+    """
+    append-only json lines journal of acknowledged import steps, so an interrupted book can resume
+    without fetching the remote book again
+
+    records (one per line, all carry "key" identifying book source + target):
+        {"type": "book", "id": book_id}
+        {"type": "volume", "title": title, "id": volume_id}
+        {"type": "chapters", "srcIdx": [[start, end], ...]}
+        {"type": "done"}  a finished book, its previous records are dropped, only the key is kept
+    """
+    def __init__(self, file_path: str, sync_every: int = 20):
+        self.file_path: str = file_path
+        self.sync_every: int = sync_every
+        self.unsynced: int = 0
+        # key -> {"book_id", "volumes": {title: id}, "chapters": set((start, end))}
+        self.states: Dict[str, dict] = {}
+        # 已完成的key，重放同一个导入计划时据此跳过
+        self.done: set = set()
+        self.load()
+        self.compact()
+        self.file = open(self.file_path, 'a', encoding='utf-8')
+
+    def __enter__(self) -> "ImportJournal":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def load(self) -> None:
+        if not os.path.exists(self.file_path):
+            return
+        with open(self.file_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    self.__apply(json.loads(line))
+                except (json.JSONDecodeError, KeyError):
+                    # 进程被杀时可能留下写了一半的行
+                    continue
+
+    def __apply(self, record: dict) -> None:
+        key = record["key"]
+        if record["type"] == "done":
+            self.states.pop(key, None)
+            self.done.add(key)
+            return
+        self.done.discard(key)
+
+        state = self.states.setdefault(key, {"book_id": None, "volumes": {}, "chapters": set()})
+        if record["type"] == "book":
+            state["book_id"] = record["id"]
+        elif record["type"] == "volume":
+            state["volumes"][record["title"]] = record["id"]
+        elif record["type"] == "chapters":
+            state["chapters"].update(tuple(src_idx) for src_idx in record["srcIdx"])
+
+    def compact(self) -> None:
+        """
+        rewrite the journal with unfinished books only
+
+        :return:
+        """
+        tmp_path = self.file_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            for key in self.done:
+                file.write(json.dumps({"key": key, "type": "done"}, ensure_ascii=False) + "\n")
+            for key, state in self.states.items():
+                records = []
+                if state["book_id"] is not None:
+                    records.append({"type": "book", "id": state["book_id"]})
+                records += [{"type": "volume", "title": title, "id": vid} for title, vid in state["volumes"].items()]
+                if state["chapters"]:
+                    records.append({"type": "chapters", "srcIdx": [list(src) for src in sorted(state["chapters"])]})
+                for record in records:
+                    record["key"] = key
+                    file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.file_path)
+
+    def resume_state(self, key: str) -> Union[dict, None]:
+        """
+        :param key:
+        :return: unfinished state of the book, None if nothing is recorded
+        """
+        state = self.states.get(key)
+        if state is None or state["book_id"] is None:
+            return None
+        return state
+
+    def is_done(self, key: str) -> bool:
+        return key in self.done
+
+    def record_book(self, key: str, book_id: int) -> None:
+        self.__write({"key": key, "type": "book", "id": book_id})
+
+    def record_volume(self, key: str, title: str, volume_id: int) -> None:
+        self.__write({"key": key, "type": "volume", "title": title, "id": volume_id})
+
+    def record_chapters(self, key: str, src_indices: List[list]) -> None:
+        self.__write({"key": key, "type": "chapters", "srcIdx": [list(src) for src in src_indices]})
+
+    def record_done(self, key: str) -> None:
+        self.__write({"key": key, "type": "done"})
+        self.flush()
+
+    def __write(self, record: dict) -> None:
+        self.__apply(record)
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        flush and fsync pending records
+
+        :return:
+        """
+        if self.file is not None and self.unsynced > 0:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
@@ -0,0 +1,74 @@
+import json
+import os
+from typing import Union, List, Dict, Any
+
+
+class ImportPlan:
+    """
+    what incremental_insert does for one book on one target, made by AbsBookCrawler.plan_insert
+    and run by AbsBookCrawler.execute_plan.
+    json serializable, so plans can be made up front, inspected, ordered and run later without parsing again.
+    a plan is a snapshot of the remote book. executing it saves the ids of the created book and volumes back
+    into the plan file; with a journal, chapters already uploaded are skipped and a finished plan is not run again.
+    without a journal, running a plan twice uploads its chapters twice
+
+    fields:
+        target: base url + namespace
+        source, source_info: identity of the book source, see AbsBookCrawler._source_key / _source_info
+        book_id: remote book, None if it has to be created from book_info (the add_book payload)
+        resumed: made from the journal instead of the remote book
+        existing_volumes: title -> id of volumes already on the target
+        volumes: [{"title", "id"}] in file order, id None for volumes to create
+        batches: [{"volume": title, "chapters": [{"title", "srcIdx"}], "bytes": source size}] in upload order
+        skipped: srcIdx of chapters already on the target
+        cover: cover image to upload alongside the chapters, None if there is none
+        operations: [{"kind", "volume", "op", "title", "after"}] merge operations an append-only upload cannot do
+                    (reorders, inserts in the middle, deletes), see BookUpdater.merge_book_info; reported only
+    """
+    def __init__(self, target: str = "", source: str = None, source_info: dict = None):
+        self.target: str = target
+        self.source: Union[str, None] = source
+        self.source_info: dict = source_info or {}
+        self.book_id: Union[int, None] = None
+        self.book_info: Union[dict, None] = None
+        self.resumed: bool = False
+        self.existing_volumes: Dict[str, int] = {}
+        self.volumes: List[dict] = []
+        self.batches: List[dict] = []
+        self.skipped: List[Any] = []
+        self.cover: Union[str, None] = None
+        self.operations: List[dict] = []
+
+    def total_bytes(self) -> int:
+        return sum(batch["bytes"] for batch in self.batches)
+
+    def chapter_count(self) -> int:
+        return sum(len(batch["chapters"]) for batch in self.batches)
+
+    def request_count(self) -> int:
+        """
+        :return: write requests needed when nothing fails
+        """
+        return (self.book_id is None) + sum(1 for volume in self.volumes if volume["id"] is None) + len(self.batches)
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+    @staticmethod
+    def from_dict(data: dict) -> "ImportPlan":
+        plan = ImportPlan()
+        for key, value in data.items():
+            if hasattr(plan, key):
+                setattr(plan, key, value)
+        return plan
+
+    def save(self, file_path: str) -> None:
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.to_dict(), file, ensure_ascii=False)
+        os.replace(tmp_path, file_path)
+
+    @staticmethod
+    def load(file_path: str) -> "ImportPlan":
+        with open(file_path, 'r', encoding='utf-8') as file:
+            return ImportPlan.from_dict(json.load(file))
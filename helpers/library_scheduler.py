@@ -0,0 +1,238 @@
+import asyncio
+import fnmatch
+import heapq
+import os
+import zipfile
+from itertools import islice
+from typing import Iterator, Tuple, List, Union
+
+from helpers.zip_source import ZIP_MEMBER_SEPARATOR, member_name
+
+BOOK_SUFFIXES = (".txt", ".txt.gz", ".txt.zst")
+
+
+class BookFilter:
+    """
+    which files of a library are books, shared by the library walk and the directory watcher
+
+    a book is a file with one of the suffixes, or a txt member of a zip archive (when zip_archives);
+    include / exclude are glob patterns matched against the path relative to the library or the file name,
+    exclude also skips whole directories
+    """
+    def __init__(self,
+                 include: List[str] = None,
+                 exclude: List[str] = None,
+                 zip_archives: bool = False,
+                 suffixes: Tuple[str, ...] = BOOK_SUFFIXES):
+        self.include: List[str] = include or []
+        self.exclude: List[str] = exclude or []
+        self.zip_archives: bool = zip_archives
+        self.suffixes: Tuple[str, ...] = suffixes
+
+    @staticmethod
+    def matches(rel_path: str, name: str, patterns: List[str]) -> bool:
+        return any(fnmatch.fnmatch(rel_path, pattern) or fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+    def is_excluded(self, rel_path: str, name: str) -> bool:
+        """
+        :param rel_path: path relative to the library, "/" separated
+        :param name: file or directory name
+        :return: the file or directory is skipped
+        """
+        return bool(self.exclude) and self.matches(rel_path, name, self.exclude)
+
+    def is_archive(self, name: str) -> bool:
+        return self.zip_archives and name.lower().endswith(".zip")
+
+    def is_book(self, rel_path: str, name: str) -> bool:
+        """
+        :param rel_path: path relative to the library, "/" separated
+        :param name: file name
+        :return: the file itself is a book (archives are not, see archive_members)
+        """
+        if not name.lower().endswith(self.suffixes) or self.is_excluded(rel_path, name):
+            return False
+        return not self.include or self.matches(rel_path, name, self.include)
+
+    def archive_members(self, path: str, rel_path: str) -> List[Tuple[str, int]]:
+        """
+        txt members of a zip archive that pass include
+
+        :param path: archive path
+        :param rel_path: archive path relative to the library
+        :return: [(member path "archive::name", uncompressed size)], empty for a bad archive
+        """
+        try:
+            with zipfile.ZipFile(path) as archive:
+                members = [(member_name(info), info.file_size) for info in archive.infolist()
+                           if not info.is_dir() and member_name(info).lower().endswith(".txt")]
+        except zipfile.BadZipFile:
+            print(f"bad zip file: {path}")
+            return []
+        return [(f"{path}{ZIP_MEMBER_SEPARATOR}{name}", size) for name, size in members
+                if not self.include or
+                self.matches(f"{rel_path}{ZIP_MEMBER_SEPARATOR}{name}", name.rsplit("/", 1)[-1], self.include)]
+
+
+def walk_library(directory: str,
+                 recursive: bool = False,
+                 include: List[str] = None,
+                 exclude: List[str] = None,
+                 zip_archives: bool = False,
+                 suffixes: Tuple[str, ...] = BOOK_SUFFIXES,
+                 priority_dirs: List[str] = None) -> Iterator[Tuple[str, int, int]]:
+    """
+    lazily walk a library with os.scandir, books are yielded as the directory listing is read, in the order
+    the file system returns them (not sorted, not a global order), so a huge directory is never held in memory.
+    only the paths of subdirectories are kept until their parent is done
+
+    :param directory:
+    :param recursive:
+    :param include: optional glob patterns, a book must match one (path relative to directory, or file name)
+    :param exclude: optional glob patterns of books and directories to skip
+    :param zip_archives: also yield txt members of zip archives
+    :param suffixes: book file suffixes
+    :param priority_dirs: optional subdirectories walked completely, in the given order, before the rest
+                          of the library (recursive walks only); the rest skips them
+    :return: generator of (path, size, mtime_ns)
+    """
+    book_filter = BookFilter(include, exclude, zip_archives, suffixes)
+    library = os.path.abspath(directory)
+    firsts = []
+    if recursive:
+        for path in priority_dirs or []:
+            rel_path = os.path.relpath(os.path.abspath(path), library).replace(os.sep, "/")
+            # 只接受库里的、没有被排除的目录；路径从directory拼出，和正常遍历得到的一致
+            path = os.path.join(directory, rel_path)
+            if rel_path != "." and rel_path != ".." and not rel_path.startswith("../") and os.path.isdir(path) \
+                    and path not in firsts and not book_filter.is_excluded(rel_path, os.path.basename(path)):
+                firsts.append(path)
+    skipped = {os.path.abspath(path) for path in firsts}
+
+    for root in firsts + [directory]:
+        stack = [root]
+        while stack:
+            current = stack.pop()
+            try:
+                it = os.scandir(current)
+            except OSError:
+                continue
+
+            subdirectories = []
+            # 边读目录边产出，不排序，巨大的目录也不整个读入内存
+            with it:
+                for entry in it:
+                    rel_path = os.path.relpath(entry.path, directory).replace(os.sep, "/")
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive and not book_filter.is_excluded(rel_path, entry.name) \
+                                    and os.path.abspath(entry.path) not in skipped:
+                                subdirectories.append(entry.path)
+                            continue
+
+                        if book_filter.is_archive(entry.name):
+                            if book_filter.is_excluded(rel_path, entry.name):
+                                continue
+                            stat = entry.stat()
+                            for member_path, size in book_filter.archive_members(entry.path, rel_path):
+                                yield member_path, size, stat.st_mtime_ns
+                            continue
+
+                        if book_filter.is_book(rel_path, entry.name):
+                            stat = entry.stat()
+                            yield entry.path, stat.st_size, stat.st_mtime_ns
+                    except OSError:
+                        # 扫描途中被删除之类
+                        continue
+
+            # 深度优先，子目录按文件系统返回的顺序
+            stack += reversed(subdirectories)
+
+
+class LibraryScheduler:
+    """
+    hand out books of a streaming walk to import workers
+
+    the walk runs in a worker thread and is kept at most lookahead books ahead of the imports,
+    books are handed out as soon as they are found, in the chosen order among the books found so far:
+        walk: walk order (directory listing order of the file system, not sorted)
+        size: smallest first (shortest job first)
+        mtime: oldest first
+        priority: books under priority_dirs first (in the given order), then walk order
+    size and mtime only sort within the lookahead window, they are not global orders: a book found later
+    is never handed out before the books already handed out. for priority, walk the priority_dirs first
+    (walk_library priority_dirs), the window then only breaks ties
+    """
+    ORDERS = ("walk", "size", "mtime", "priority")
+
+    def __init__(self,
+                 books: Iterator[Tuple[str, int, int]],
+                 order: str = "walk",
+                 lookahead: int = 1000,
+                 priority_dirs: List[str] = None):
+        if order not in self.ORDERS:
+            raise ValueError(f"unknown order: {order}")
+        self.books: Iterator[Tuple[str, int, int]] = books
+        self.order: str = order
+        self.lookahead: int = lookahead
+        self.priority_dirs: List[str] = [os.path.abspath(path) for path in priority_dirs or []]
+        self.heap: list = []
+        self.counter: int = 0
+        self.walk_done: bool = False
+        self.__condition: Union[asyncio.Condition, None] = None
+
+    @property
+    def _condition(self) -> asyncio.Condition:
+        # 在事件循环里才创建
+        if self.__condition is None:
+            self.__condition = asyncio.Condition()
+        return self.__condition
+
+    def __key(self, path: str, size: int, mtime_ns: int) -> tuple:
+        self.counter += 1
+        if self.order == "size":
+            return size, self.counter
+        if self.order == "mtime":
+            return mtime_ns, self.counter
+        if self.order == "priority":
+            path = os.path.abspath(path)
+            rank = next((i for i, directory in enumerate(self.priority_dirs)
+                         if path.startswith(directory + os.sep)), len(self.priority_dirs))
+            return rank, self.counter
+        return (self.counter,)
+
+    async def run_walker(self, chunk: int = 64) -> None:
+        """
+        feed the scheduler from the walk until it ends, run it alongside the workers
+
+        :param chunk: books taken from the walk per thread hop
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                async with self._condition:
+                    await self._condition.wait_for(lambda: len(self.heap) < self.lookahead)
+                books = await loop.run_in_executor(None, lambda: list(islice(self.books, chunk)))
+                async with self._condition:
+                    for path, size, mtime_ns in books:
+                        heapq.heappush(self.heap, (self.__key(path, size, mtime_ns), path, size, mtime_ns))
+                    self._condition.notify_all()
+                if len(books) < chunk:
+                    return
+        finally:
+            async with self._condition:
+                self.walk_done = True
+                self._condition.notify_all()
+
+    async def next_book(self) -> Union[Tuple[str, int, int], None]:
+        """
+        :return: (path, size, mtime_ns) of the next book, None when the walk is done and every book is handed out
+        """
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.heap or self.walk_done)
+            if not self.heap:
+                return None
+            _, path, size, mtime_ns = heapq.heappop(self.heap)
+            self._condition.notify_all()
+            return path, size, mtime_ns
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Union
+
+from helpers.book_toc import BookToc
+
+MAGIC = b"NCTOC\x00\x00\x01"
+# 解析逻辑变化时增加，旧缓存随之失效
+PARSE_VERSION = 1
+# 依次存放的数组，都是'q'
+_ARRAYS = ("volume_starts", "volume_ends", "volume_titles", "volume_first_chapters",
+           "chapter_starts", "chapter_ends", "chapter_titles", "title_offsets")
+
+
+def sample_hash(file_path: str, sample_size: int = 64 * 1024) -> str:
+    """
+    cheap content hash: size plus the head, middle and tail of the file
+
+    :param file_path:
+    :param sample_size:
+    :return:
+    """
+    size = os.path.getsize(file_path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(file_path, 'rb') as file:
+        for pos in (0, max(0, size // 2 - sample_size // 2), max(0, size - sample_size)):
+            file.seek(pos)
+            digest.update(file.read(sample_size))
+    return digest.hexdigest()
+
+
+class ParseCache:
+    """
+    central cache directory of parse results, one binary file per source
+
+    file layout:
+        MAGIC, uint32 header length, json header (key, encoding, title, author, excerpt, array lengths),
+        padding to 8 bytes, the int64 arrays of BookToc (_ARRAYS), title buffer
+    the key holds everything the result depends on (source identity, content sample, heading rules, ...),
+    an entry whose key differs is stale and will be overwritten
+    """
+    def __init__(self, directory: str):
+        self.directory: str = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def entry_path(self, source_path: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(source_path.encode('utf-8')).hexdigest() + ".toc")
+
+    def load(self, source_path: str, key: dict) -> Union[dict, None]:
+        """
+        :param source_path:
+        :param key:
+        :return: {"encoding", "title", "author", "excerpt", "volumes": BookToc}, None if missing or stale
+        """
+        path = self.entry_path(source_path)
+        try:
+            with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data[:len(MAGIC)] != MAGIC:
+                    return None
+                header_length, = struct.unpack_from("<I", data, len(MAGIC))
+                pos = len(MAGIC) + 4
+                header = json.loads(bytes(data[pos:pos + header_length]).decode('utf-8'))
+                if header["key"] != key or header["byteorder"] != sys.byteorder:
+                    return None
+                pos = self.__align(pos + header_length)
+                if len(data) != pos + sum(header["lengths"]) * 8 + header["title_buffer"]:
+                    # 写了一半的文件之类
+                    return None
+
+                toc = BookToc()
+                view = memoryview(data)
+                try:
+                    for name, length in zip(_ARRAYS, header["lengths"]):
+                        values = array('q')
+                        values.frombytes(view[pos:pos + length * 8])
+                        setattr(toc, name, values)
+                        pos += length * 8
+                    toc.title_buffer = bytearray(view[pos:pos + header["title_buffer"]])
+                finally:
+                    view.release()
+        except (OSError, ValueError, KeyError, struct.error):
+            return None
+
+        return {
+            "encoding": header["encoding"],
+            "title": header["title"],
+            "author": header["author"],
+            "excerpt": header["excerpt"],
+            "volumes": toc,
+        }
+
+    def store(self, source_path: str, key: dict, encoding: str, book_data: dict) -> None:
+        """
+        :param source_path:
+        :param key:
+        :param encoding:
+        :param book_data: result of the scanner handler
+        :return:
+        """
+        toc: BookToc = book_data["volumes"]
+        header = json.dumps({
+            "key": key,
+            "byteorder": sys.byteorder,
+            "encoding": encoding,
+            "title": book_data["title"],
+            "author": book_data["author"],
+            "excerpt": book_data.get("excerpt", ""),
+            "lengths": [len(getattr(toc, name)) for name in _ARRAYS],
+            "title_buffer": len(toc.title_buffer),
+        }, ensure_ascii=False).encode('utf-8')
+
+        path = self.entry_path(source_path)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            file.write(MAGIC)
+            file.write(struct.pack("<I", len(header)))
+            file.write(header)
+            pos = len(MAGIC) + 4 + len(header)
+            file.write(b"\x00" * (self.__align(pos) - pos))
+            for name in _ARRAYS:
+                getattr(toc, name).tofile(file)
+            file.write(toc.title_buffer)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def __align(pos: int) -> int:
+        return (pos + 7) // 8 * 8
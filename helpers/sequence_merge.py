@@ -0,0 +1,159 @@
+from bisect import bisect_left
+from typing import List, Tuple, Callable, Any, Dict, Hashable
+
+from abs_book_updater import SyncBehavior
+
+
+def occurrence_keys(keys: List[Hashable]) -> List[Tuple[Hashable, int]]:
+    """
+    make keys unique by numbering repeats: [a, b, a] -> [(a, 0), (b, 0), (a, 1)]
+
+    :param keys:
+    :return:
+    """
+    counts = {}
+    result = []
+    for key in keys:
+        n = counts.get(key, 0)
+        counts[key] = n + 1
+        result.append((key, n))
+    return result
+
+
+def longest_increasing_subsequence(values: List[int]) -> List[int]:
+    """
+    patience sorting, O(n log n)
+
+    :param values: distinct values
+    :return: indices (into values) of one longest strictly increasing subsequence
+    """
+    # tails[k]: 长度为k+1的递增子序列的最小结尾值，tail_indices为其下标
+    tails = []
+    tail_indices = []
+    previous = [-1] * len(values)
+    for i, value in enumerate(values):
+        k = bisect_left(tails, value)
+        if k == len(tails):
+            tails.append(value)
+            tail_indices.append(i)
+        else:
+            tails[k] = value
+            tail_indices[k] = i
+        previous[i] = tail_indices[k - 1] if k > 0 else -1
+
+    result = []
+    i = tail_indices[-1] if tail_indices else -1
+    while i != -1:
+        result.append(i)
+        i = previous[i]
+    result.reverse()
+    return result
+
+
+def align(old_keys: List[Hashable], new_keys: List[Hashable]) -> List[Tuple[int, int]]:
+    """
+    longest common subsequence of two sequences of unique keys, via the longest increasing subsequence
+    of the new positions of the common keys (patience diff without the recursion, as keys are unique)
+
+    :param old_keys: unique keys
+    :param new_keys: unique keys
+    :return: matched (old index, new index) pairs, in order
+    """
+    new_positions = {key: j for j, key in enumerate(new_keys)}
+    common = [(i, new_positions[key]) for i, key in enumerate(old_keys) if key in new_positions]
+    return [common[k] for k in longest_increasing_subsequence([j for _, j in common])]
+
+
+def merge_sequences(old: List[Any],
+                    new: List[Any],
+                    key: Callable[[Any], Hashable],
+                    rm_behavior: SyncBehavior = SyncBehavior.MergeRemovedWithInertia) -> Tuple[List[dict], List[dict]]:
+    """
+    merge the new (local) order into the old (remote) sequence
+
+    items only in old (removed) are handled by rm_behavior:
+        DiscardRemoved: deleted
+        MergeRemovedStickily: kept right after the item they followed, moving along with it
+        MergeRemovedWithInertia: kept in place, after the nearest preceding item that does not move
+    the operations turn old into the merged sequence, in order: deletes, then inserts and moves from front to back,
+    each placed after an item already in place; moves are minimal (everything off the common subsequence)
+
+    :param old: remote items
+    :param new: local items
+    :param key: identity of an item (e.g. title), repeated keys are matched by occurrence
+    :param rm_behavior:
+    :return: merged [{"key", "old", "new"}] (old / new item, None if absent) and
+             operations [{"op": "insert" | "move" | "delete", "key", "item", "after": key or None,
+                          "append": no old item follows it, i.e. an append at the end}]
+    """
+    old_keys = occurrence_keys([key(item) for item in old])
+    new_keys = occurrence_keys([key(item) for item in new])
+    new_positions = {k: j for j, k in enumerate(new_keys)}
+    old_positions = {k: i for i, k in enumerate(old_keys)}
+    stable = {i for i, _ in align(old_keys, new_keys)}
+    removed = [i for i, k in enumerate(old_keys) if k not in new_positions]
+
+    # 被删除的项跟随的旧项（-1表示开头）
+    followers: Dict[int, List[int]] = {}
+    if rm_behavior != SyncBehavior.DiscardRemoved:
+        removed_set = set(removed)
+        anchor = -1
+        for i in range(len(old)):
+            if i in removed_set:
+                followers.setdefault(anchor, []).append(i)
+                # 跟随前一项的，连续删除的项依次跟随
+                anchor = i
+            elif rm_behavior == SyncBehavior.MergeRemovedStickily or i in stable:
+                # 惯性模式下只跟随不移动的项
+                anchor = i
+
+    merged = []
+
+    def emit_followers(i: int) -> None:
+        # 连续删除的项可能很长，不用递归
+        stack = list(reversed(followers.get(i, [])))
+        while stack:
+            follower = stack.pop()
+            merged.append({"key": old_keys[follower], "old": old[follower], "new": None})
+            stack += reversed(followers.get(follower, []))
+
+    emit_followers(-1)
+    for j, k in enumerate(new_keys):
+        i = old_positions.get(k)
+        merged.append({"key": k, "old": old[i] if i is not None else None, "new": new[j]})
+        if i is not None:
+            emit_followers(i)
+
+    # 合并后的顺序里，旧项的最长递增子序列保持不动，其余移动
+    merged_old = [(n, old_positions[entry["key"]]) for n, entry in enumerate(merged) if entry["old"] is not None]
+    in_place = {merged_old[k][0] for k in longest_increasing_subsequence([i for _, i in merged_old])}
+
+    last_old = max((n for n, _ in merged_old), default=-1)
+    operations = []
+    if rm_behavior == SyncBehavior.DiscardRemoved:
+        operations += [{"op": "delete", "key": old_keys[i], "item": old[i], "after": None, "append": False}
+                       for i in removed]
+    for n, entry in enumerate(merged):
+        if n in in_place:
+            continue
+        operations.append({
+            "op": "insert" if entry["old"] is None else "move",
+            "key": entry["key"],
+            "item": entry["new"] if entry["old"] is None else entry["old"],
+            "after": merged[n - 1]["key"] if n > 0 else None,
+            "append": n > last_old,
+        })
+    return merged, operations
+
+
+def is_adjacent(a: Hashable, b: Hashable, keys: List[Hashable]) -> bool:
+    """
+    :param a:
+    :param b:
+    :param keys:
+    :return: b comes right after a in keys
+    """
+    for i in range(len(keys) - 1):
+        if keys[i] == a and keys[i + 1] == b:
+            return True
+    return False
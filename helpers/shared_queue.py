@@ -0,0 +1,256 @@
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import time
+import uuid
+from typing import Dict, Union, List, Callable, Awaitable
+
+
+class SharedWorkQueue:
+    """
+    coordinate importer nodes that see the same library through a shared directory (e.g. over nfs),
+    no service needed, only atomic file operations:
+        claims/<key>: created with O_EXCL by the node importing the book, the lease;
+                      its mtime is refreshed every heartbeat seconds, a claim older than lease seconds is expired
+        done/<key>: written when the book is imported, with the version (size and mtime) imported;
+                    the book is claimed again only when its version changes (e.g. a serialized novel gains chapters)
+        clock/<node>: touched to read the file server time, so node clocks need not agree
+    an expired claim is taken over by renaming it away, only one node can win the rename;
+    the owner of a claim taken over finds out on its next heartbeat (lost)
+
+    keys are book paths relative to the library, so nodes may mount it at different places
+    """
+    def __init__(self, directory: str, node: str = None, lease: float = 300.0, heartbeat: float = None):
+        self.directory: str = directory
+        self.node: str = node or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease: float = lease
+        self.heartbeat: float = heartbeat or lease / 5
+        self.claims_dir: str = os.path.join(directory, "claims")
+        self.done_dir: str = os.path.join(directory, "done")
+        self.clock_path: str = os.path.join(directory, "clock", self.node)
+        for path in (self.claims_dir, self.done_dir, os.path.dirname(self.clock_path)):
+            os.makedirs(path, exist_ok=True)
+        # key -> 本节点写入claim时的token
+        self.held: Dict[str, str] = {}
+        # key -> 被其他节点接管时set
+        self.lost: Dict[str, asyncio.Event] = {}
+
+    @staticmethod
+    def __file_name(key: str) -> str:
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def __claim_path(self, key: str) -> str:
+        return os.path.join(self.claims_dir, self.__file_name(key))
+
+    def __done_path(self, key: str) -> str:
+        return os.path.join(self.done_dir, self.__file_name(key))
+
+    def __server_now(self) -> float:
+        # 共享文件系统上utime(None)使用服务器时间
+        with open(self.clock_path, 'a'):
+            pass
+        os.utime(self.clock_path)
+        return os.stat(self.clock_path).st_mtime
+
+    @staticmethod
+    def __read_claim(path: str) -> Union[dict, None]:
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def version(size: int, mtime_ns: int) -> str:
+        return f"{size}:{mtime_ns}"
+
+    def is_done(self, key: str, version: str = None) -> bool:
+        """
+        :param key:
+        :param version: optional, see version(); a book done at another version is not done
+        :return:
+        """
+        done = self.__read_claim(self.__done_path(key))
+        if done is None:
+            return False
+        # 没有记录版本的旧标记视为完成
+        return version is None or done.get("version") in (None, version)
+
+    def claim(self, key: str, version: str = None) -> bool:
+        """
+        try to own a book, blocking file io
+
+        :param key: book path relative to the library
+        :param version: optional, see version()
+        :return: owned or not (done at this version, or claimed by a live node)
+        """
+        if self.is_done(key, version):
+            return False
+        path = self.__claim_path(key)
+        # 接管过期的claim后再试一次
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self.__take_over(path):
+                    return False
+                continue
+
+            token = uuid.uuid4().hex
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump({"key": key, "node": self.node, "token": token, "claimed": time.time()}, file,
+                          ensure_ascii=False)
+                file.flush()
+                os.fsync(file.fileno())
+            # 上一个持有者可能刚好完成并释放
+            if self.is_done(key, version):
+                self.__remove(path)
+                return False
+            self.held[key] = token
+            return True
+        return False
+
+    def __take_over(self, path: str) -> bool:
+        """
+        move an expired claim out of the way
+
+        :param path: claim file
+        :return: the claim is gone, claiming may be retried
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return True
+        if self.__server_now() - stat.st_mtime < self.lease:
+            return False
+
+        stale_path = f"{path}.{uuid.uuid4().hex}.stale"
+        try:
+            os.rename(path, stale_path)
+        except FileNotFoundError:
+            # 其他节点抢先接管或持有者释放了
+            return True
+        try:
+            renamed = os.stat(stale_path)
+            if (renamed.st_ino, renamed.st_mtime_ns) != (stat.st_ino, stat.st_mtime_ns):
+                # 改名前刚好续期了，或者已经是别人的新claim：放回去
+                try:
+                    os.link(stale_path, path)
+                except FileExistsError:
+                    pass
+                return False
+            owner = self.__read_claim(stale_path) or {}
+            print(f"taking over expired claim of {owner.get('node')}: {owner.get('key')}")
+            return True
+        finally:
+            self.__remove(stale_path)
+
+    def refresh(self) -> List[str]:
+        """
+        heartbeat: renew the claims still owned, forget the ones taken over. blocking file io
+
+        :return: keys of the claims lost
+        """
+        lost = []
+        for key, token in list(self.held.items()):
+            path = self.__claim_path(key)
+            claim = self.__read_claim(path)
+            if claim is None or claim.get("token") != token:
+                print(f"claim lost: {key}")
+                self.held.pop(key, None)
+                lost.append(key)
+                continue
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                continue
+        return lost
+
+    def lost_event(self, key: str) -> asyncio.Event:
+        """
+        :param key:
+        :return: event set when the claim of key is taken over by another node
+        """
+        return self.lost.setdefault(key, asyncio.Event())
+
+    def release(self, key: str, done: bool, version: str = None) -> None:
+        """
+        give up a book, blocking file io
+
+        :param key:
+        :param done: imported, do not claim it again until its version changes
+        :param version: optional, the version imported
+        :return:
+        """
+        self.lost.pop(key, None)
+        token = self.held.pop(key, None)
+        if done:
+            # 先写完成标记再删claim，中间不会被其他节点重新领取
+            done_path = self.__done_path(key)
+            tmp_path = f"{done_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump({"key": key, "node": self.node, "done": time.time(), "version": version}, file,
+                          ensure_ascii=False)
+            os.replace(tmp_path, done_path)
+        if token is not None:
+            path = self.__claim_path(key)
+            claim = self.__read_claim(path)
+            if claim is not None and claim.get("token") == token:
+                self.__remove(path)
+
+    def release_all(self) -> None:
+        for key in list(self.held):
+            self.release(key, False)
+
+    async def run_claimed(self, key: str, job: Callable[[], Awaitable[bool]],
+                          version: str = None) -> Union[bool, None]:
+        """
+        run job if the book can be claimed; the job is cancelled when the claim is lost,
+        the book is marked done (at version) when the job succeeds
+
+        :param key:
+        :param job: returns success or not
+        :param version: optional, see version()
+        :return: result of job, None if not claimed or lost
+        """
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(None, self.claim, key, version):
+            return None
+
+        result = None
+        try:
+            task = asyncio.ensure_future(job())
+            lost = asyncio.ensure_future(self.lost_event(key).wait())
+            try:
+                await asyncio.wait([task, lost], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                lost.cancel()
+                if not task.done():
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+            if not task.cancelled():
+                result = task.result()
+        finally:
+            await loop.run_in_executor(None, self.release, key, bool(result), version)
+        return result
+
+    async def run_heartbeat(self) -> None:
+        """
+        renew the claims every heartbeat seconds until cancelled
+
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            for key in await loop.run_in_executor(None, self.refresh):
+                self.lost_event(key).set()
+
+    @staticmethod
+    def __remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
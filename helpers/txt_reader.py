@@ -1,6 +1,13 @@
+import asyncio
+import os
 import re
+import tempfile
+import threading
+from concurrent.futures import Executor
 from typing import BinaryIO, AnyStr, Callable, Any, Tuple, Union, List
 
+from helpers.compressed_file import is_compressed_path, open_seekable_compressed
+
 
 class TxtBookReader:
     """
@@ -9,6 +16,18 @@ class TxtBookReader:
     def __init__(self):
         self.encoding: str = ''
         self.file: Union[BinaryIO, None] = None
+        self.file_path: str = ''
+        # 扫描时给行分类（比如标题规则），见classify_line
+        self.line_classifier: Union[Callable[[str], Any], None] = None
+        # 最近一次read_continuous_content_lines读过的块：(起始字节, 结束字节, 字符数)，扫描时顺带统计
+        self.last_block: Tuple[int, int, int] = (0, 0, 0)
+        # 异步读取用的线程池，None为事件循环默认的线程池
+        self.read_executor: Union[Executor, None] = None
+        # file就是file_path本身（不是解压/溢出的临时文件），没有os.pread时可以另开句柄
+        self.__plain_file: bool = False
+        # 没有os.pread时，定位读取用的独立句柄
+        self.__positional_file: Union[BinaryIO, None] = None
+        self.__positional_lock: threading.Lock = threading.Lock()
         # self.file_path = file_path
 
     def __enter__(self) -> "TxtBookReader":
@@ -18,22 +37,45 @@ class TxtBookReader:
     def __exit__(self, exc_type, exc_val, exc_tb) -> None:
         self.close()
 
-    def open(self, file_path: str) -> "TxtBookReader":
+    def open(self, file_path: str, file: BinaryIO = None) -> "TxtBookReader":
+        """
+        :param file_path:
+        :param file_path: plain, .gz or .zst (see helpers.compressed_file) file
+        :param file: optional, an opened seekable binary file to read instead (e.g. a decompressed archive member),
+                     file_path is then only its name. it is closed with this reader
+        :return:
+        """
         if self.file is None:
-            self.file = open(file_path, 'rb')
+            self.__plain_file = file is None and not is_compressed_path(file_path)
+            if file is None:
+                # .gz：第一次扫描时建立解压检查点，之后按偏移读取只从最近的检查点解压；.zst：解压到临时文件
+                file = open(file_path, 'rb') if self.__plain_file else open_seekable_compressed(file_path)
+            self.file = file
+            self.file_path = file_path
         return self
 
     def close(self):
         if self.file is not None:
             self.file.close()
             self.file = None
-
-    def scan_file(self, scan_handler: Callable[["TxtBookReader"], Any]) -> Any:
+            self.file_path = ''
+        with self.__positional_lock:
+            if self.__positional_file is not None:
+                self.__positional_file.close()
+                self.__positional_file = None
+        self.last_block = (0, 0, 0)
+
+    def scan_file(self,
+                  scan_handler: Callable[["TxtBookReader"], Any],
+                  line_classifier: Callable[[str], Any] = None) -> Any:
         """
-        scan this file with a scan handler
+        scan this file with a scan handler, the handler raises UnicodeDecodeError on a wrong encoding
+        (every line it reads is decoded), then the next encoding is tried
         :param scan_handler: a callable where take this reader as the only parameter, return any
+        :param line_classifier: optional, see classify_line
         :return: the return value of scan handler
         """
+        self.line_classifier = line_classifier
         try:
             self.__init_scan('gb18030')
             return scan_handler(self)
@@ -45,8 +87,112 @@ class TxtBookReader:
 
     def __init_scan(self, encoding):
         self.encoding = encoding
+        self.last_block = (0, 0, 0)
         self.reset()
 
+    def classify_line(self, line: str) -> Any:
+        """
+        :param line: decoded line
+        :return: result of the line classifier given to scan_file, None without one
+        """
+        return self.line_classifier(line) if self.line_classifier is not None else None
+
+    def char_count(self, start_pos: int, end_pos: int) -> int:
+        """
+        character count between two byte positions,
+        counted while reading when they are the last block read by read_continuous_content_lines,
+        otherwise decode the bytes between
+
+        :param start_pos:
+        :param end_pos:
+        :return:
+        """
+        if end_pos <= start_pos:
+            return 0
+        block_start, block_end, block_chars = self.last_block
+        if (start_pos, end_pos) == (block_start, block_end):
+            return block_chars
+        return len(self.get_between_text(start_pos, end_pos))
+
+    def read_at(self, pos: int, size: int) -> bytes:
+        """
+        positional read, does not use or move the file pointer, safe to call from several threads
+
+        :param pos: byte offset
+        :param size: byte count
+        :return: at most size bytes
+        """
+        if size <= 0:
+            return b""
+        fd = self.__fileno()
+        if fd is not None and hasattr(os, "pread"):
+            parts = []
+            while size > 0:
+                part = os.pread(fd, size, pos)
+                if not part:
+                    break
+                parts.append(part)
+                pos += len(part)
+                size -= len(part)
+            return b"".join(parts)
+
+        with self.__positional_lock:
+            if fd is None:
+                # 内存中的文件：加锁使用共享的指针，读完恢复
+                cursor = self.file.tell()
+                self.file.seek(pos)
+                data = self.file.read(size)
+                self.file.seek(cursor)
+                return data
+
+            if not self.__plain_file:
+                # 溢出到磁盘的zip成员、解压出的.zst之类，没有可以另开的路径
+                cursor = self.file.tell()
+                self.file.seek(pos)
+                data = self.file.read(size)
+                self.file.seek(cursor)
+                return data
+
+            # 比如windows：另开一个句柄，加锁定位读取
+            if self.__positional_file is None:
+                self.__positional_file = open(self.file_path, 'rb')
+            self.__positional_file.seek(pos)
+            return self.__positional_file.read(size)
+
+    def __fileno(self) -> Union[int, None]:
+        file = self.file
+        if isinstance(file, tempfile.SpooledTemporaryFile):
+            # fileno()会让内存中的文件溢出到磁盘，只用已经溢出的
+            if not getattr(file, "_rolled", True):
+                return None
+            file = getattr(file, "_file", None)
+        try:
+            return file.fileno()
+        except (AttributeError, OSError, ValueError):
+            # io.UnsupportedOperation是OSError、ValueError的子类
+            return None
+
+    def read_text_at(self, start_pos: int, end_pos: int) -> str:
+        """
+        positional version of get_between_text
+
+        :param start_pos:
+        :param end_pos:
+        :return:
+        """
+        return self.read_at(start_pos, end_pos - start_pos).decode(self.encoding)
+
+    async def aread_text_at(self, start_pos: int, end_pos: int) -> str:
+        """
+        read_text_at in read_executor, so the event loop is not blocked by disk io
+
+        :param start_pos:
+        :param end_pos:
+        :return:
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self.read_executor, self.read_text_at, start_pos, end_pos)
+
     def reset(self) -> None:
         self.file.seek(0)
 
@@ -129,13 +275,7 @@ class TxtBookReader:
         return self.readline_binary().decode(self.encoding)
 
     def get_between_text(self, start_pos, end_pos):
-        pos = self.tell()
-        self.seek(start_pos)
-        # content = self.read(end_pos - start_pos).decode(self.encoding)
-        content = self.read(end_pos - start_pos)
-
-        self.seek(pos)
-        return content
+        return self.read_text_at(start_pos, end_pos)
 
     def peek_line_binary(self) -> AnyStr:
         pos: int = self.tell()
@@ -187,11 +327,13 @@ class TxtBookReader:
 
     def read_continuous_content_lines(self):
         """
-        scan all continues not empty lines
+        scan all continues not empty lines, their character count is kept in last_block
 
         :return:
         """
+        start_pos: int = self.tell()
         pos: int
+        chars: int = 0
         while True:
             pos = self.tell()
             line = self.readline()
@@ -199,7 +341,9 @@ class TxtBookReader:
 
             if not line or self.is_line_empty(line):
                 break
+            chars += len(line)
         self.seek(pos)
+        self.last_block = (start_pos, pos, chars)
 
     def read_until_next_block(self, mxm_empty: int = 1):
         """
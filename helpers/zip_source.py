@@ -0,0 +1,180 @@
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import List, Tuple, BinaryIO, Dict
+
+# 压缩包内文件的路径：archive.zip::dir/name.txt
+ZIP_MEMBER_SEPARATOR = "::"
+
+
+def member_name(info: zipfile.ZipInfo) -> str:
+    """
+    decoded member name. names without the utf-8 flag are decoded by zipfile as cp437,
+    but archives made on chinese windows store them in gbk
+
+    :param info:
+    :return:
+    """
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode('cp437').decode('gb18030')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+def is_zip_member_path(path: str) -> bool:
+    return ZIP_MEMBER_SEPARATOR in path
+
+
+def split_member_path(path: str) -> Tuple[str, str]:
+    """
+    :param path: archive.zip::member
+    :return: (archive path, member name)
+    """
+    archive_path, _, name = path.partition(ZIP_MEMBER_SEPARATOR)
+    return archive_path, name
+
+
+def list_zip_txt(archive_path: str, suffix: str = ".txt") -> List[str]:
+    """
+    :param archive_path:
+    :param suffix:
+    :return: member paths of all matched members
+    """
+    with zipfile.ZipFile(archive_path) as archive:
+        return [f"{archive_path}{ZIP_MEMBER_SEPARATOR}{member_name(info)}" for info in archive.infolist()
+                if not info.is_dir() and member_name(info).lower().endswith(suffix)]
+
+
+class ZipArchiveCache:
+    """
+    zip archives kept open, with their members indexed by decoded name, so the members of an archive imported
+    one after another read its central directory once instead of once per lookup.
+    an archive changed on disk (size or mtime) is opened again, the least recently used ones are closed
+    """
+    def __init__(self, capacity: int = 8):
+        self.capacity: int = capacity
+        # 绝对路径 -> ((大小, 修改时间), ZipFile, {成员名: ZipInfo})
+        self.archives: "OrderedDict[str, Tuple[Tuple[int, int], zipfile.ZipFile, Dict[str, zipfile.ZipInfo]]]" = \
+            OrderedDict()
+        self.lock: threading.Lock = threading.Lock()
+
+    def __get(self, archive_path: str) -> Tuple[zipfile.ZipFile, Dict[str, zipfile.ZipInfo]]:
+        # 调用方持有锁
+        key = os.path.abspath(archive_path)
+        stat = os.stat(archive_path)
+        version = (stat.st_size, stat.st_mtime_ns)
+        cached = self.archives.get(key)
+        if cached is not None:
+            if cached[0] == version:
+                self.archives.move_to_end(key)
+                return cached[1], cached[2]
+            del self.archives[key]
+            cached[1].close()
+
+        archive = zipfile.ZipFile(archive_path)
+        members = {}
+        for info in archive.infolist():
+            if not info.is_dir():
+                # 同名成员取第一个
+                members.setdefault(member_name(info), info)
+        self.archives[key] = (version, archive, members)
+        while len(self.archives) > self.capacity:
+            self.archives.popitem(last=False)[1][1].close()
+        return archive, members
+
+    def info(self, path: str) -> zipfile.ZipInfo:
+        """
+        :param path: member path
+        :return: raise FileNotFoundError if the archive or the member is missing, zipfile.BadZipFile if broken
+        """
+        archive_path, name = split_member_path(path)
+        with self.lock:
+            _, members = self.__get(archive_path)
+        if name not in members:
+            raise FileNotFoundError(path)
+        return members[name]
+
+    def open(self, path: str, info: zipfile.ZipInfo = None) -> BinaryIO:
+        """
+        :param path: member path
+        :param info: optional, the member from info(), looked up again otherwise
+        :return: decompressing stream of the member, readable after the archive is closed or evicted
+        """
+        archive_path, name = split_member_path(path)
+        with self.lock:
+            archive, members = self.__get(archive_path)
+            if info is None:
+                if name not in members:
+                    raise FileNotFoundError(path)
+                info = members[name]
+            # 打开的成员持有文件的引用，之后关闭ZipFile不影响读取
+            return archive.open(info)
+
+    def clear(self) -> None:
+        with self.lock:
+            for _, archive, _ in self.archives.values():
+                archive.close()
+            self.archives.clear()
+
+
+# 进程内共用
+zip_archives: ZipArchiveCache = ZipArchiveCache()
+
+
+def zip_member_info(path: str) -> zipfile.ZipInfo:
+    """
+    :param path: member path
+    :return: the member, from the shared archive cache
+    """
+    return zip_archives.info(path)
+
+
+def open_zip_member(path: str, spool_size: int = 64 * 1024 * 1024, info: zipfile.ZipInfo = None) -> BinaryIO:
+    """
+    decompress a member once into a seekable temporary file (in memory up to spool_size, on disk beyond),
+    chapters are then read from it by offset
+
+    :param path: member path
+    :param spool_size:
+    :param info: optional, the member from zip_member_info
+    :return: binary file positioned at 0, deleted when closed
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    try:
+        with zip_archives.open(path, info) as member:
+            shutil.copyfileobj(member, spool, 1024 * 1024)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def zip_member_key(path: str, info: zipfile.ZipInfo = None) -> str:
+    """
+    identity of a member: archive path, name, size and crc, unaffected by other members of the archive
+
+    :param path: member path
+    :param info: optional, the member from zip_member_info
+    :return:
+    """
+    archive_path, name = split_member_path(path)
+    if info is None:
+        info = zip_member_info(path)
+    return f"{os.path.abspath(archive_path)}{ZIP_MEMBER_SEPARATOR}{name}|{info.file_size}|{info.CRC}"
+
+
+def zip_member_exists(path: str) -> bool:
+    archive_path, _ = split_member_path(path)
+    if not os.path.isfile(archive_path):
+        return False
+    try:
+        zip_member_info(path)
+        return True
+    except (zipfile.BadZipFile, FileNotFoundError):
+        return False
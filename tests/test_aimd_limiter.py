@@ -0,0 +1,24 @@
+import asyncio
+
+import pytest
+
+from helpers.aimd_limiter import AimdLimiter
+
+
+def released_limit(status, latency: float = 0.01) -> float:
+    async def run() -> float:
+        limiter = AimdLimiter(initial=8)
+        await limiter.acquire()
+        await limiter.release(latency, status, "GET /books")
+        return limiter.limit
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("status", [429, 500, 502, 503, 504, None])
+def test_overload_decreases(status):
+    assert released_limit(status) == 4.0
+
+
+@pytest.mark.parametrize("status", [200, 201, 400, 404])
+def test_success_and_client_errors_increase(status):
+    assert released_limit(status) > 8.0
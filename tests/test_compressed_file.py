@@ -0,0 +1,71 @@
+import gzip
+import io
+import random
+
+import pytest
+
+from helpers.compressed_file import SeekableDecompressedFile, open_seekable_compressed
+from helpers.txt_reader import TxtBookReader
+
+
+@pytest.fixture(scope="module")
+def content():
+    rng = random.Random(3)
+    lines = [f"第{i}章 " + "".join(rng.choice("春夏秋冬风花雪月") for _ in range(rng.randrange(10, 200)))
+             for i in range(3000)]
+    return "\n".join(lines).encode('utf-8')
+
+
+def random_reads(file, content, count=300):
+    rng = random.Random(5)
+    for _ in range(count):
+        pos = rng.randrange(len(content) + 10)
+        size = rng.randrange(1, 50000)
+        file.seek(pos)
+        assert file.read(size) == content[pos:pos + size]
+
+
+def test_gzip_random_access(tmp_path, content):
+    path = str(tmp_path / "book.txt.gz")
+    with open(path, 'wb') as file:
+        file.write(gzip.compress(content))
+    raw = SeekableDecompressedFile(path, checkpoint_span=64 * 1024)
+    with io.BufferedReader(raw) as file:
+        random_reads(file, content)
+        assert file.seek(0, io.SEEK_END) == len(content)
+    # 单个成员也每checkpoint_span建立检查点，不是只有开头
+    assert len(raw.checkpoint_offsets) > len(content) // (64 * 1024)
+
+
+def test_gzip_multi_member(tmp_path, content):
+    path = str(tmp_path / "book.txt.gz")
+    with open(path, 'wb') as file:
+        for start in range(0, len(content), 100000):
+            file.write(gzip.compress(content[start:start + 100000]))
+    with open_seekable_compressed(path, checkpoint_span=64 * 1024) as file:
+        random_reads(file, content)
+
+
+@pytest.mark.parametrize("frame_size", [None, 100000])
+def test_zstd_random_access(tmp_path, content, frame_size):
+    zstandard = pytest.importorskip("zstandard")
+    path = str(tmp_path / "book.txt.zst")
+    compressor = zstandard.ZstdCompressor()
+    with open(path, 'wb') as file:
+        step = frame_size or len(content)
+        for start in range(0, len(content), step):
+            file.write(compressor.compress(content[start:start + step]))
+    with open_seekable_compressed(path) as file:
+        random_reads(file, content)
+        assert file.seek(0, io.SEEK_END) == len(content)
+
+
+def test_reader_positional_reads(tmp_path, content):
+    path = str(tmp_path / "book.txt.gz")
+    with open(path, 'wb') as file:
+        file.write(gzip.compress(content))
+    with TxtBookReader().open(path) as reader:
+        rng = random.Random(9)
+        for _ in range(100):
+            pos = rng.randrange(len(content))
+            assert reader.read_at(pos, 1000) == content[pos:pos + 1000]
@@ -0,0 +1,39 @@
+import random
+
+from crawlers.local_book_crawler import LocalBookCrawler
+from helpers.fingerprint import sketch_similarity
+
+
+def write_book(path, seed: int, chapters: int = 40, insert_at: int = None) -> str:
+    """
+    every chapter is one long opening paragraph (longer than the 256 byte sample key)
+    """
+    rng = random.Random(seed)
+    paragraphs = ["".join(chr(0x4e00 + rng.randrange(3000)) for _ in range(300)) for _ in range(chapters)]
+    if insert_at is not None:
+        paragraphs.insert(insert_at, "".join(chr(0x4e00 + rng.randrange(3000)) for _ in range(300)))
+    lines = ["书名", "作者：某人", ""]
+    for i, paragraph in enumerate(paragraphs):
+        lines += [f"第{i + 1}章 标题{i + 1}", f"　　{paragraph}", ""]
+    path.write_text("\n".join(lines), encoding="utf-8")
+    return str(path)
+
+
+def fingerprint(file_path: str) -> list:
+    crawler = LocalBookCrawler()
+    with crawler.open(file_path):
+        crawler.load_contents()
+        return crawler.fingerprint(sample_chapters=8)
+
+
+def test_long_opening_paragraphs_tell_books_apart(tmp_path):
+    a = fingerprint(write_book(tmp_path / "a.txt", 1))
+    b = fingerprint(write_book(tmp_path / "b.txt", 2))
+    assert a and b
+    assert sketch_similarity(a, b) < 0.2
+
+
+def test_inserted_chapter_keeps_fingerprint(tmp_path):
+    a = fingerprint(write_book(tmp_path / "a.txt", 1))
+    a_inserted = fingerprint(write_book(tmp_path / "a2.txt", 1, insert_at=5))
+    assert sketch_similarity(a, a_inserted) > 0.7
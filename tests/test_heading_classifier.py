@@ -0,0 +1,53 @@
+import pytest
+
+from helpers.heading_classifier import HeadingClassifier
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return HeadingClassifier()
+
+
+@pytest.mark.parametrize("line, kind", [
+    ("第一章 开始", "chapter"),
+    ("  第12回 风起", "chapter"),
+    ("【第三卷】 北上", "volume"),
+    ("卷二 归途", "volume"),
+    ("楔子", "chapter"),
+    ("Chapter 12", "chapter"),
+    ("CHAPTER XLII The Storm", "chapter"),
+    ("Chapter xiv", "chapter"),
+    ("ch 5", "chapter"),
+    ("Part I", "volume"),
+    ("Book III: The End", "volume"),
+    ("vol.iv", "volume"),
+    ("Volume C", "volume"),
+])
+def test_headings(classifier, line, kind):
+    assert classifier.classify(line) == kind
+
+
+@pytest.mark.parametrize("line", [
+    # 罗马数字的字母组成的普通单词
+    "Part ill",
+    "Book civil",
+    "Book ivy",
+    "Chapter cd",
+    "Parti",
+    "Chapter 3rd",
+    "Chapter",
+    # 超过max_length的行
+    "第一章" + "很长" * 30,
+])
+def test_not_headings(classifier, line):
+    assert classifier.classify(line) is None
+
+
+def test_find_headings_matches_classify(classifier):
+    lines = ["第一卷 起", "正文。", "第一章 开始", "Part ill", "Chapter ii", "正文。"]
+    text = "\n".join(lines)
+    offsets = [text.index(line) for line in lines]
+    expected = [(offset, classifier.classify(line)) for offset, line in zip(offsets, lines)
+                if classifier.classify(line)]
+    assert list(classifier.find_headings(text)) == expected
+    assert [kind for _, kind in expected] == ["volume", "chapter", "chapter"]
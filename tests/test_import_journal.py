@@ -0,0 +1,70 @@
+import json
+
+from helpers.import_journal import ImportJournal
+
+
+def records(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        return [json.loads(line) for line in file]
+
+
+def test_resume_after_reopen(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    with ImportJournal(path) as journal:
+        journal.record_book("a", 1)
+        journal.record_volume("a", "第一卷", 10)
+        journal.record_chapters("a", [[0, 100], [100, 200]])
+        journal.record_chapters("a", [[200, 300]])
+
+    with ImportJournal(path) as journal:
+        state = journal.resume_state("a")
+        assert state["book_id"] == 1
+        assert state["volumes"] == {"第一卷": 10}
+        assert state["chapters"] == {(0, 100), (100, 200), (200, 300)}
+        assert journal.resume_state("b") is None
+        assert not journal.is_done("a")
+
+
+def test_done_compacted_on_reopen(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    with ImportJournal(path) as journal:
+        journal.record_book("a", 1)
+        journal.record_chapters("a", [[0, 100]])
+        journal.record_done("a")
+        journal.record_book("b", 2)
+        journal.record_chapters("b", [[0, 50]])
+        journal.record_chapters("b", [[50, 80]])
+    assert len(records(path)) == 6
+
+    with ImportJournal(path) as journal:
+        assert journal.is_done("a")
+        assert journal.resume_state("a") is None
+        assert journal.resume_state("b")["chapters"] == {(0, 50), (50, 80)}
+    # 完成的书只留下key，未完成的章节合并成一行
+    assert sorted((record["key"], record["type"]) for record in records(path)) == \
+        [("a", "done"), ("b", "book"), ("b", "chapters")]
+
+
+def test_torn_last_line_ignored(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    with ImportJournal(path) as journal:
+        journal.record_book("a", 1)
+    with open(path, 'a', encoding='utf-8') as file:
+        file.write('{"key": "a", "type": "chap')
+
+    with ImportJournal(path) as journal:
+        assert journal.resume_state("a")["book_id"] == 1
+        journal.record_chapters("a", [[0, 10]])
+    with ImportJournal(path) as journal:
+        assert journal.resume_state("a")["chapters"] == {(0, 10)}
+
+
+def test_reimport_after_done(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    with ImportJournal(path) as journal:
+        journal.record_book("a", 1)
+        journal.record_done("a")
+        journal.record_book("a", 2)
+    with ImportJournal(path) as journal:
+        assert not journal.is_done("a")
+        assert journal.resume_state("a")["book_id"] == 2
@@ -0,0 +1,54 @@
+import random
+
+from crawlers.local_book_crawler import LocalBookCrawler
+
+
+def write_book(path, seed: int = 7) -> str:
+    """
+    volumes, long and short chapters, stray short paragraphs, single and double empty lines
+    """
+    rng = random.Random(seed)
+
+    def paragraph(length: int) -> str:
+        return "　　" + "".join(chr(0x4e00 + rng.randrange(3000)) for _ in range(length))
+
+    lines = ["=" * 20, "广告", "=" * 20, "书名", "作者：某人", "", "内容简介：", paragraph(80), "", ""]
+    chapter = 0
+    for volume in range(6):
+        lines += [f"第{volume + 1}卷 卷名{volume + 1}", "", ""]
+        for _ in range(rng.randrange(20, 60)):
+            chapter += 1
+            lines.append(f"第{chapter}章 章名{chapter}")
+            for _ in range(rng.randrange(1, 12)):
+                lines.append(paragraph(rng.choice((20, 150, 400))))
+                if rng.random() < 0.1:
+                    lines.append("")
+            lines += [""] * rng.choice((1, 1, 2, 3))
+            if rng.random() < 0.05:
+                lines += ["一段短的附言", ""]
+    path.write_text("\n".join(lines), encoding="utf-8")
+    return str(path)
+
+
+def parse(file_path: str, parse_workers: int) -> tuple:
+    crawler = LocalBookCrawler(parse_workers=parse_workers)
+    crawler.parallel_parse_threshold = 0
+    try:
+        with crawler.open(file_path):
+            crawler.load_contents()
+            data = crawler.txt_book_data
+            toc = data["volumes"]
+            return (data["title"], data["author"], data["excerpt"],
+                    list(toc.volume_titles), list(toc.volume_starts), list(toc.volume_ends),
+                    list(toc.chapter_titles), list(toc.chapter_starts), list(toc.chapter_ends))
+    finally:
+        if crawler.parse_executor is not None:
+            crawler.parse_executor.shutdown()
+
+
+def test_parallel_toc_matches_serial(tmp_path):
+    file_path = write_book(tmp_path / "book.txt")
+    serial = parse(file_path, 1)
+    assert len(serial[6]) > 100
+    for workers in (2, 3, 8):
+        assert parse(file_path, workers) == serial
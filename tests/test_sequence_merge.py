@@ -0,0 +1,86 @@
+import random
+
+import pytest
+
+from abs_book_updater import SyncBehavior
+from helpers.sequence_merge import merge_sequences, is_adjacent
+
+
+def apply(old, operations):
+    """
+    replay the operations on a remote order as the updaters do
+    """
+    result = list(old)
+    for op in operations:
+        if op["op"] == "delete":
+            result.remove(op["key"][0])
+            continue
+        if op["op"] == "move":
+            result.remove(op["key"][0])
+        if op["after"] is None:
+            result.insert(0, op["key"][0])
+        else:
+            result.insert(result.index(op["after"][0]) + 1, op["key"][0])
+    return result
+
+
+def merged_keys(merged):
+    return [entry["key"][0] for entry in merged]
+
+
+def test_discard_removed():
+    merged, operations = merge_sequences(list("abcde"), list("aXcbe"), lambda item: item, SyncBehavior.DiscardRemoved)
+    assert merged_keys(merged) == list("aXcbe")
+    assert apply("abcde", operations) == list("aXcbe")
+    assert [op["op"] for op in operations].count("delete") == 1
+    # 只移动最长公共子序列以外的项
+    assert [op["op"] for op in operations].count("move") == 1
+
+
+def test_removed_kept_stickily():
+    # d跟着c移动到前面
+    merged, operations = merge_sequences(list("abcd"), list("cab"), lambda item: item,
+                                         SyncBehavior.MergeRemovedStickily)
+    assert merged_keys(merged) == list("cdab")
+    assert apply("abcd", operations) == list("cdab")
+
+
+def test_removed_kept_with_inertia():
+    # d留在原处，跟在不动的b后面
+    merged, operations = merge_sequences(list("abcd"), list("cab"), lambda item: item,
+                                         SyncBehavior.MergeRemovedWithInertia)
+    assert merged_keys(merged) == list("cabd")
+    assert apply("abcd", operations) == list("cabd")
+
+
+def test_append_flag():
+    _, operations = merge_sequences(list("ab"), list("abcd"), lambda item: item)
+    assert [(op["op"], op["key"][0], op["append"]) for op in operations] == [("insert", "c", True),
+                                                                            ("insert", "d", True)]
+
+
+def test_repeated_keys_matched_by_occurrence():
+    merged, operations = merge_sequences(["x", "y", "x"], ["x", "x", "y"], lambda item: item)
+    assert [entry["key"] for entry in merged] == [("x", 0), ("x", 1), ("y", 0)]
+    assert len(operations) == 1
+
+
+@pytest.mark.parametrize("behavior", list(SyncBehavior))
+def test_random_operations_reproduce_merge(behavior):
+    rng = random.Random(7)
+    for _ in range(200):
+        old = rng.sample(range(30), rng.randrange(0, 15))
+        new = rng.sample(range(30), rng.randrange(0, 15))
+        merged, operations = merge_sequences(old, new, lambda item: item, behavior)
+        assert apply(old, operations) == merged_keys(merged)
+        # 新序列的顺序保持
+        assert [k for k in merged_keys(merged) if k in new] == new
+
+
+def test_is_adjacent():
+    keys = ["a", "b", "c", "a"]
+    assert is_adjacent("a", "b", keys)
+    assert is_adjacent("c", "a", keys)
+    assert not is_adjacent("b", "a", keys)
+    assert not is_adjacent("a", "c", keys)
+    assert not is_adjacent("a", "b", [])
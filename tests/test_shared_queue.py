@@ -0,0 +1,99 @@
+import asyncio
+import os
+
+from helpers.shared_queue import SharedWorkQueue
+
+
+def age_claims(queue: SharedWorkQueue, seconds: float) -> None:
+    # 把所有claim的修改时间往前拨，模拟持有者停止心跳
+    for name in os.listdir(queue.claims_dir):
+        path = os.path.join(queue.claims_dir, name)
+        mtime = os.stat(path).st_mtime - seconds
+        os.utime(path, (mtime, mtime))
+
+
+def test_claim_is_exclusive(tmp_path):
+    a = SharedWorkQueue(str(tmp_path), node="a", lease=60)
+    b = SharedWorkQueue(str(tmp_path), node="b", lease=60)
+    assert a.claim("book.txt")
+    assert not b.claim("book.txt")
+    a.release("book.txt", False)
+    assert b.claim("book.txt")
+
+
+def test_expired_claim_taken_over(tmp_path):
+    a = SharedWorkQueue(str(tmp_path), node="a", lease=60)
+    b = SharedWorkQueue(str(tmp_path), node="b", lease=60)
+    assert a.claim("book.txt")
+    age_claims(a, 120)
+    assert b.claim("book.txt")
+    # 原持有者在下一次心跳时发现
+    assert a.refresh() == ["book.txt"]
+    assert "book.txt" not in a.held
+    # 原持有者释放时不能删掉新持有者的claim
+    a.release("book.txt", False)
+    assert not a.claim("book.txt")
+    assert b.refresh() == []
+
+
+def test_live_claim_not_taken_over(tmp_path):
+    a = SharedWorkQueue(str(tmp_path), node="a", lease=60)
+    b = SharedWorkQueue(str(tmp_path), node="b", lease=60)
+    assert a.claim("book.txt")
+    age_claims(a, 30)
+    assert not b.claim("book.txt")
+    assert a.refresh() == []
+
+
+def test_done_until_version_changes(tmp_path):
+    a = SharedWorkQueue(str(tmp_path), node="a")
+    b = SharedWorkQueue(str(tmp_path), node="b")
+    v1 = SharedWorkQueue.version(100, 1)
+    v2 = SharedWorkQueue.version(200, 2)
+    assert a.claim("book.txt", v1)
+    a.release("book.txt", True, v1)
+    assert b.is_done("book.txt", v1)
+    assert not b.claim("book.txt", v1)
+    # 连载的书更新了
+    assert not b.is_done("book.txt", v2)
+    assert b.claim("book.txt", v2)
+
+
+def test_run_claimed(tmp_path):
+    queue = SharedWorkQueue(str(tmp_path), node="a")
+
+    async def job() -> bool:
+        return True
+
+    async def failing_job() -> bool:
+        return False
+
+    async def run():
+        assert await queue.run_claimed("ok.txt", job, "1:1") is True
+        assert await queue.run_claimed("ok.txt", job, "1:1") is None
+        assert await queue.run_claimed("bad.txt", failing_job) is False
+        assert not queue.is_done("bad.txt")
+        assert queue.held == {}
+    asyncio.run(run())
+
+
+def test_lost_claim_cancels_job(tmp_path):
+    queue = SharedWorkQueue(str(tmp_path), node="a")
+    cancelled = []
+
+    async def job() -> bool:
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return True
+
+    async def run():
+        task = asyncio.ensure_future(queue.run_claimed("book.txt", job))
+        await asyncio.sleep(0.1)
+        queue.lost_event("book.txt").set()
+        assert await task is None
+    asyncio.run(run())
+    assert cancelled
+    assert not queue.is_done("book.txt")